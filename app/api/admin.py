@@ -1,31 +1,42 @@
 from __future__ import annotations
+import asyncio
 import os
 import secrets
-from pathlib import Path
+from collections.abc import AsyncIterator
 from typing import Annotated, Any, Dict, List
 
+import orjson
+
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, Body, status
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import get_db
+from app.db.session import get_db, SessionLocal
 from app.db.models import Credential, Nonce
+from app.services.cache import admin_html_cache
+from app.services.credentials import invalidate_credential
+from app.templating import templates
 
 # --- CONFIGURACIÓN ---
 router = APIRouter(prefix="/admin", tags=["admin"])
 security = HTTPBasic()
 
-BASE_DIR = Path(__file__).resolve().parents[2]
-TEMPLATES_DIR = BASE_DIR / "app" / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-
 # --- DEPENDENCIES ---
 DBDep = Annotated[AsyncSession, Depends(get_db)]
+# Paginación: acota memoria e IO por petición aunque las tablas crezcan
+LimitQ = Annotated[int, Query(ge=1, le=1000, description="Máximo de filas por tabla")]
+OffsetQ = Annotated[int, Query(ge=0, description="Filas a saltar (paginación)")]
+
+# --- CREDENCIALES DE ADMINISTRACIÓN ---
+# En producción se leen de .env; si no existen usamos los valores de la demo
+# (Usuario: admin / Pass: dap-secret).
+# Se leen y codifican UNA vez al importar: evitamos os.getenv + encode por petición.
+_ADMIN_USER_B = os.getenv("ADMIN_USER", "admin").encode("utf-8")
+_ADMIN_PASS_B = os.getenv("ADMIN_PASS", "dap-secret").encode("utf-8")
 
 # --- SEGURIDAD (MEJORADA: HTTP Basic Auth RFC 7617) ---
 def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
@@ -33,16 +44,10 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     Verifica usuario y contraseña usando comparación segura (tiempo constante).
     Elimina la necesidad de pasar tokens por URL.
     """
-    # En producción leeríamos de .env, aquí hardcodeamos para la demo segura
-    # Usuario: admin
-    # Pass: dap-secret
-    
-    # Intenta leer de variables de entorno si existen, si no usa los default
-    env_user = os.getenv("ADMIN_USER", "admin")
-    env_pass = os.getenv("ADMIN_PASS", "dap-secret")
-    
-    correct_username = secrets.compare_digest(credentials.username, env_user)
-    correct_password = secrets.compare_digest(credentials.password, env_pass)
+    # Comparamos bytes: compare_digest sobre str lanza TypeError con caracteres no ASCII.
+    # Evaluamos ambas comparaciones siempre para no filtrar cuál de las dos falló.
+    correct_username = secrets.compare_digest(credentials.username.encode("utf-8"), _ADMIN_USER_B)
+    correct_password = secrets.compare_digest(credentials.password.encode("utf-8"), _ADMIN_PASS_B)
 
     if not (correct_username and correct_password):
         raise HTTPException(
@@ -52,6 +57,33 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials.username
 
+# --- LECTURAS CONCURRENTES ---
+async def _fetch_all(stmt):
+    """
+    Ejecuta una lectura en su propia sesión.
+    Una conexión no puede ejecutar dos queries a la vez: con una sesión por query
+    podemos solaparlas con asyncio.gather (cada una toma su conexión del pool).
+    """
+    async with SessionLocal() as session:
+        return (await session.execute(stmt)).all()
+
+# --- VOLCADO EN STREAMING ---
+# Filas por lote del cursor: la memoria pico es O(lote), no O(tabla)
+_STREAM_BATCH = 500
+
+async def _stream_rows(session, stmt, encode) -> AsyncIterator[tuple[bytes, int]]:
+    """
+    Recorre `stmt` con un cursor en streaming y devuelve, por lote, los objetos JSON
+    de cada fila (orjson por fila) unidos por comas, junto al número de filas del lote.
+    """
+    result = await session.stream(stmt)
+    async for rows in result.partitions(_STREAM_BATCH):
+        yield b",".join(orjson.dumps(encode(row)) for row in rows), len(rows)
+
+# Proyecciones de columnas: filas (tuplas) planas en lugar de objetos ORM hidratados
+CRED_COLUMNS = (Credential.jti, Credential.status, Credential.created_at, Credential.token)
+NONCE_COLUMNS = (Nonce.value, Nonce.expires_at, Nonce.consumed_at)
+
 # --- DTOs ---
 class RevokeRequest(BaseModel):
     jti: str
@@ -59,85 +91,102 @@ class RevokeRequest(BaseModel):
 
 # --- ENDPOINTS ---
 
-@router.get("/db", summary="Volcado de base de datos (Debug)")
+@router.get("/db", response_class=StreamingResponse, summary="Volcado de base de datos (Debug)")
 async def admin_db(
     request: Request, 
-    db: DBDep, 
-    username: str = Depends(get_current_username)
+    username: str = Depends(get_current_username),
+    limit: LimitQ = 200,
+    offset: OffsetQ = 0,
 ):
-    """Devuelve un JSON con el estado crudo de las tablas (Protegido)."""
-    
-    creds_rows = (await db.execute(select(Credential))).scalars().all()
-    credentials_data = [
-        {
-            "jti": c.jti,
-            "status": c.status,
-            "created_at": c.created_at.isoformat() if c.created_at else None,
-            "token_snippet": (c.token[:30] + "...") if c.token else None,
+    """
+    Devuelve un JSON con el estado crudo de las tablas (Protegido).
+    Se emite en streaming: las filas se serializan (orjson, datetimes nativos) a medida
+    que llegan del cursor, sin construir las listas completas en memoria.
+    """
+
+    def encode_credential(row):
+        jti, status_, created_at, token = row
+        return {
+            "jti": jti,
+            "status": status_,
+            "created_at": created_at,
+            "token_snippet": (token[:30] + "...") if token else None,
         }
-        for c in creds_rows
-    ]
-
-    nonces_rows = (await db.execute(select(Nonce))).scalars().all()
-    nonces_data = [
-        {
-            "value": n.value,
-            "expires_at": n.expires_at.isoformat() if n.expires_at else None,
-            "consumed_at": n.consumed_at.isoformat() if n.consumed_at else None,
+
+    def encode_nonce(row):
+        value, expires_at, consumed_at = row
+        return {
+            "value": value,
+            "expires_at": expires_at,
+            "consumed_at": consumed_at,
         }
-        for n in nonces_rows
-    ]
-
-    return JSONResponse({
-        "summary": {
-            "total_credentials": len(credentials_data),
-            "total_nonces": len(nonces_data)
-        },
-        "credentials": credentials_data,
-        "nonces": nonces_data
-    })
+
+    async def body() -> AsyncIterator[bytes]:
+        # Sesión propia: la del request podría cerrarse antes de terminar el streaming
+        async with SessionLocal() as session:
+            totals = {}
+            sections = (
+                ("credentials", encode_credential,
+                 select(*CRED_COLUMNS).order_by(Credential.created_at.desc()).limit(limit).offset(offset)),
+                ("nonces", encode_nonce,
+                 select(*NONCE_COLUMNS).order_by(Nonce.expires_at.desc()).limit(limit).offset(offset)),
+            )
+            for i, (name, encode, stmt) in enumerate(sections):
+                yield (b'{"' if i == 0 else b'],"') + name.encode() + b'":['
+                total = 0
+                async for chunk, count in _stream_rows(session, stmt, encode):
+                    yield (b"," if total else b"") + chunk
+                    total += count
+                totals[name] = total
+
+        # El resumen va al final: los totales solo se conocen tras recorrer las filas
+        yield b'],"summary":' + orjson.dumps({
+            "total_credentials": totals["credentials"],
+            "total_nonces": totals["nonces"],
+            "limit": limit,
+            "offset": offset
+        }) + b"}"
+
+    return StreamingResponse(body(), media_type="application/json")
 
 @router.get("/ui", response_class=HTMLResponse, summary="Panel de Control Web")
 async def admin_ui(
     request: Request, 
-    db: DBDep, 
-    username: str = Depends(get_current_username)
+    username: str = Depends(get_current_username),
+    limit: LimitQ = 200,
+    offset: OffsetQ = 0,
 ):
     """Renderiza el Dashboard de administración (Protegido con Basic Auth)."""
-    
-    creds_rows = (await db.execute(
-        select(Credential).order_by(Credential.created_at.desc())
-    )).scalars().all()
-    
-    nonces_rows = (await db.execute(
-        select(Nonce).order_by(Nonce.expires_at.desc())
-    )).scalars().all()
-
-    def fmt_dt(dt):
-        return dt.strftime("%Y-%m-%d %H:%M:%S") if dt else "-"
 
+    # Refrescos seguidos del panel: servimos el HTML ya renderizado sin tocar BD ni Jinja
+    cache_key = (username, limit, offset)
+    html = admin_html_cache.get(cache_key)
+    if html is not None:
+        return HTMLResponse(html)
+    
+    creds_rows, nonces_rows = await asyncio.gather(
+        _fetch_all(
+            select(*CRED_COLUMNS).order_by(Credential.created_at.desc()).limit(limit).offset(offset)
+        ),
+        _fetch_all(
+            select(*NONCE_COLUMNS).order_by(Nonce.expires_at.desc()).limit(limit).offset(offset)
+        ),
+    )
+
+    # Las filas van directas a la plantilla; las fechas se formatean con el filtro fmt_dt
     context = {
         "request": request,
         "user": username,
-        "creds": [
-            {
-                "jti": c.jti,
-                "status": c.status,
-                "created_at": fmt_dt(c.created_at),
-                "token_start": (c.token[:50] + "...") if c.token else "N/A",
-            } for c in creds_rows
-        ],
-        "nonces": [
-            {
-                "value": n.value,
-                "expires_at": fmt_dt(n.expires_at),
-                "consumed_at": fmt_dt(n.consumed_at),
-                "is_active": n.consumed_at is None
-            } for n in nonces_rows
-        ]
+        # Huellas de las filas: claves de {% cache %} que cambian en cuanto cambian los datos
+        "creds_key": hash(tuple(creds_rows)),
+        "nonces_key": hash(tuple(nonces_rows)),
+        "creds": creds_rows,
+        "nonces": nonces_rows,
     }
 
-    return templates.TemplateResponse("admin.html", context)
+    response = templates.TemplateResponse("admin.html", context)
+    admin_html_cache.set(cache_key, response.body)
+    return response
 
 @router.post("/revoke", summary="Revocación de Credencial")
 async def revoke_credential(
@@ -148,15 +197,24 @@ async def revoke_credential(
 ):
     """Ejecuta la revocación lógica (Protegido)."""
     
-    stmt = select(Credential).where(Credential.jti == body.jti)
-    result = await db.execute(stmt)
-    credential = result.scalar_one_or_none()
-
-    if not credential:
+    # Una sola sentencia (UPDATE ... RETURNING): sin lectura previa ni unit-of-work del ORM.
+    # El WHERE hace la operación atómica; si no devuelve fila, el JTI no existe.
+    stmt = (
+        update(Credential)
+        .where(Credential.jti == body.jti)
+        .values(status="revoked")
+        .returning(Credential.jti)
+    )
+    revoked = (await db.execute(stmt)).first()
+
+    if not revoked:
         raise HTTPException(status_code=404, detail=f"Credencial con JTI '{body.jti}' no encontrada.")
     
-    credential.status = "revoked"
     await db.commit()
+
+    # Liberamos el QR cacheado: la credencial revocada ya no se va a servir
+    invalidate_credential(body.jti)
+    admin_html_cache.clear()
     
     return {
         "status": "ok",
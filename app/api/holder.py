@@ -1,32 +1,70 @@
 from __future__ import annotations
+import hashlib
 from io import BytesIO
-from pathlib import Path
 from typing import Annotated
 
 from fastapi import APIRouter, HTTPException, Response, Depends, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-# Importamos jwt para decodificar los datos visuales
-import jwt
 # Importamos qrcode para la generación robusta
 import qrcode
+from qrcode.image.pure import PyPNGImage
 
 from app.db.session import get_db
 from app.db.models import Credential
+from app.services.cache import qr_png_cache
+from app.services.credentials import get_credential
+from app.templating import templates
 
 # --- CONFIGURACIÓN ---
 router = APIRouter(prefix="/holder", tags=["holder"])
 
-BASE_DIR = Path(__file__).resolve().parents[2]
-TEMPLATES_DIR = BASE_DIR / "app" / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-
 # --- DEPENDENCIES ---
 DBDep = Annotated[AsyncSession, Depends(get_db)]
 
+# Cabeceras comunes de la imagen QR (el contenido es inmutable por JTI)
+QR_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+# --- HELPERS ---
+
+def _etag(jti: str, status: str) -> str:
+    """ETag fuerte derivado de jti+estado: el token de un JTI no cambia, solo su estado."""
+    return '"' + hashlib.blake2b(f"{jti}:{status}".encode(), digest_size=8).hexdigest() + '"'
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """True si el If-None-Match del cliente ya contiene `etag` (admite lista, '*' y W/)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+def _render_qr_png(data: str) -> bytes:
+    """
+    Codifica `data` como QR y devuelve los bytes PNG.
+    Es síncrona a propósito: se ejecuta en el threadpool para no bloquear el event loop.
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=10,
+        border=4,
+        # PyPNG escribe el PNG en escala de grises de 1 bit directamente desde la matriz:
+        # ~50% menos bytes que el PNG de PIL. Codifica algo más lento, pero el resultado
+        # se cachea por JTI y el tamaño se paga en cada descarga.
+        image_factory=PyPNGImage,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    # PyPNG es estrictamente blanco/negro: no admite fill_color/back_color
+    buffer = BytesIO()
+    qr.make_image().save(buffer)
+    return buffer.getvalue()
+
 # --- ENDPOINTS ---
 
 @router.get("", response_class=HTMLResponse, summary="Cartera Digital (Dashboard)")
@@ -35,112 +73,70 @@ async def holder_ui(request: Request, db: DBDep):
     Renderiza la Cartera Digital con todas las credenciales activas.
     Combina la persistencia del código nuevo con la robustez visual.
     """
-    # 1. Recuperamos credenciales
+    # 1. Recuperamos credenciales (solo las columnas que pinta la vista)
     result = await db.execute(
-        select(Credential).where(Credential.status == "valid").order_by(Credential.created_at.desc())
+        select(Credential.jti, Credential.token, Credential.created_at)
+        .where(Credential.status == "valid")
+        .order_by(Credential.created_at.desc())
     )
-    creds_rows = result.scalars().all()
-
-    # 2. Procesamos datos para la vista (SSR)
-    display_creds = []
-    
-    for c in creds_rows:
-        parsed_data = {
-            "jti": c.jti,
-            "token": c.token,
-            "event": "Desconocido",
-            "bib": "-",
-            "name": "-",
-            "time": "-",
-            "date": c.created_at.strftime("%Y-%m-%d %H:%M") if c.created_at else ""
-        }
-        
-        try:
-            # Decodificación segura para visualización
-            payload = jwt.decode(c.token, options={"verify_signature": False})
-            vc_subject = payload.get("vc", {}).get("credentialSubject", {})
-            
-            # Corrección de anidamiento (si existe)
-            if "credentialSubject" in vc_subject:
-                vc_subject = vc_subject["credentialSubject"]
-            
-            parsed_data["event"] = vc_subject.get("event", "Evento Genérico")
-            parsed_data["bib"] = vc_subject.get("bib", "-")
-            parsed_data["name"] = vc_subject.get("name", "Atleta")
-            
-            if "result" in vc_subject and isinstance(vc_subject["result"], dict):
-                parsed_data["time"] = vc_subject["result"].get("time", "-")
-            else:
-                parsed_data["time"] = vc_subject.get("time", "-")
-                
-        except Exception:
-            pass
-            
-        display_creds.append(parsed_data)
+    creds_rows = result.all()
 
+    # 2. Las filas van directas a la plantilla (SSR): los filtros fmt_dt y jwt_subject
+    #    formatean la fecha y leen el credentialSubject al pintar cada tarjeta
     return templates.TemplateResponse("holder.html", {
         "request": request,
-        "credentials": display_creds
+        "credentials": creds_rows
     })
 
 @router.get("/{jti}/qr.png", summary="Generar QR (Backend Local)")
-async def holder_qr(jti: str, db: DBDep):
+async def holder_qr(jti: str, request: Request, db: DBDep):
     """
     Genera el QR localmente usando la librería qrcode.
-    Incluye cabeceras de caché para optimizar el rendimiento en el cliente.
+    Incluye cabeceras de caché (Cache-Control + ETag) para optimizar el rendimiento en el cliente.
     """
-    # 1. Validamos que la credencial existe
-    query = select(Credential).where(Credential.jti == jti)
-    result = await db.execute(query)
-    credential = result.scalar_one_or_none()
-    
-    if not credential:
+    # 1. Validamos que la credencial existe y sigue vigente (revocada => 404 sin generar nada).
+    #    El estado se lee siempre de la BD: un PNG cacheado no implica credencial válida.
+    credential = await get_credential(db, jti)
+
+    if credential is None or credential.status != "valid":
         raise HTTPException(status_code=404, detail="Credencial no encontrada")
 
-    # 2. Generación Robusta 
-    try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=10,
-            border=4,
-        )
-        
-        # Codificamos el JTI (Puntero a la credencial)
-        qr.add_data(credential.jti)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        buffer.seek(0)
-        
-        # MEJORA: Cache-Control para evitar regeneración innecesaria
-        return Response(
-            content=buffer.getvalue(), 
-            media_type="image/png",
-            headers={"Cache-Control": "public, max-age=31536000, immutable"}
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando QR: {str(e)}")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando QR: {str(e)}")
+    # 2. Revalidación: si el cliente ya tiene esta versión, 304 sin cuerpo ni codificación PNG
+    headers = {**QR_HEADERS, "ETag": _etag(jti, "valid")}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # Caché en memoria del PNG (inmutable por JTI): en un acierto no se vuelve a codificar
+    png = qr_png_cache.get(jti)
+    if png is None:
+        # 3. Generación Robusta (CPU pura: fuera del event loop, en el threadpool)
+        #    Solo capturamos los fallos de codificación/escritura: un except Exception
+        #    también se tragaría errores de programación y los convertiría en 500 opacos.
+        try:
+            png = await run_in_threadpool(_render_qr_png, jti)
+        except (OSError, ValueError) as e:
+            raise HTTPException(status_code=500, detail=f"Error generando QR: {e}")
+
+        qr_png_cache.set(jti, png)
+
+    # MEJORA: Cache-Control para evitar regeneración innecesaria
+    return Response(content=png, media_type="image/png", headers=headers)
 
 @router.get("/{jti}.json", summary="JSON Raw")
-async def holder_json(jti: str, db: DBDep):
+async def holder_json(jti: str, request: Request, db: DBDep):
     """Endpoint auxiliar para ver el JSON crudo (Debug)."""
-    query = select(Credential).where(Credential.jti == jti)
-    result = await db.execute(query)
-    credential = result.scalar_one_or_none()
+    credential = await get_credential(db, jti)
     
-    if not credential:
+    if credential is None:
         raise HTTPException(status_code=404, detail="No encontrado")
+
+    # El ETag cambia con el estado (p.ej. al revocar), así que el cliente siempre revalida
+    headers = {"ETag": _etag(credential.jti, credential.status), "Cache-Control": "no-cache"}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
     
-    return JSONResponse({
+    return ORJSONResponse({
         "jti": credential.jti, 
         "token": credential.token,
         "status": credential.status
-    })
+    }, headers=headers)
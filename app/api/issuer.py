@@ -1,89 +1,177 @@
 from __future__ import annotations
-from pathlib import Path
-from typing import Any, Annotated
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Annotated, Final
 
 # AÑADIDO: UploadFile y File para recibir imágenes
 from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request, UploadFile, File
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services.vc import issue_vc_jwt
 from app.db.session import get_db
 from app.db.models import Credential
+from app.services.cache import ocr_result_cache
+from app.templating import STATIC_PAGE_HEADERS, render_static
 
 # AÑADIDO: Importamos el servicio OCR
 from app.services.ocr import extract_race_data
 
 router = APIRouter(prefix="/issuer", tags=["issuer"])
 
-TEMPLATES_DIR = Path(__file__).resolve().parents[1] / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-
 # --- DEPENDENCIES ---
 DBDep = Annotated[AsyncSession, Depends(get_db)]
 
+# --- POOL OCR ---
+# El OCR es CPU pura (preprocesado + Tesseract con OMP_THREAD_LIMIT=1): N procesos de un
+# hilo escalan con las CPUs sin competir por el GIL ni bloquear el event loop.
+# El pool vive en app.state y lo crea/cierra el lifespan (main.py).
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+# Trabajos de OCR admitidos a la vez (en curso + en cola del pool). Por encima se responde
+# 503: mejor rechazar pronto que acumular imágenes en memoria esperando minutos.
+OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", "0")) or OCR_WORKERS * 2
+# Profundidad actual de la cola (solo se toca desde el event loop: no necesita lock)
+ocr_pending = 0
+
+def create_ocr_pool() -> ProcessPoolExecutor:
+    # 'spawn': el proceso padre ya tiene hilos (pool de BD, threadpool) y fork los copiaría a medias.
+    # Los workers solo importan app.services.ocr (PIL/Tesseract), no la app entera.
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def _app_pool(request: Request, name: str) -> Executor | None:
+    """
+    Pool creado en el lifespan (app.state). Sin lifespan (p.ej. un TestClient usado sin
+    'with') no existe: None hace que run_in_executor use el executor por defecto del loop.
+    """
+    return getattr(request.app.state, name, None)
+
+async def run_ocr(request: Request, image_bytes: bytes) -> dict:
+    """
+    Ejecuta extract_race_data en el pool de procesos de la app.
+    El OCR es determinista en los bytes de la imagen: memorizamos por su hash.
+    """
+    global ocr_pending
+    key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+    data = ocr_result_cache.get(key)
+    if data is None:
+        if ocr_pending >= OCR_MAX_PENDING:
+            raise HTTPException(
+                status_code=503, detail="OCR saturado, inténtalo de nuevo", headers={"Retry-After": "1"}
+            )
+        ocr_pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(_app_pool(request, "ocr_pool"), extract_race_data, image_bytes)
+        finally:
+            ocr_pending -= 1
+        # Los fallos (p.ej. motor no disponible) no se memorizan: pueden ser transitorios
+        if "error" not in data:
+            ocr_result_cache.set(key, data)
+    return data
+
+# Tamaño máximo de la foto a analizar (una foto de móvil ronda 3-8 MB)
+OCR_MAX_UPLOAD_BYTES = int(os.getenv("OCR_MAX_UPLOAD_MB", "15")) * 1024 * 1024
+
+# --- POOL DE FIRMA ---
+# La firma (OpenSSL vía cryptography) libera el GIL: con hilos, las emisiones en ráfaga
+# firman en paralelo y el event loop sigue atendiendo. También vive en app.state.
+CRYPTO_WORKERS = min(8, os.cpu_count() or 1)
+
+def create_crypto_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+
 # --- MODELS ---
+class CredentialSchema(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    id: str
+    type: str
+
 class VCModel(BaseModel):
+    """
+    Sobre de la credencial con campos fijos: sin diccionario de extras, pydantic-core
+    valida con un esquema cerrado. El payload libre va dentro de credentialSubject.
+    """
+    model_config = ConfigDict(extra="forbid", frozen=True, populate_by_name=True)
+
+    context: list[str] | str | None = Field(None, alias="@context")
+    id: str | None = None
     # Aceptamos lista de strings (estándar) o string único (por compatibilidad)
     type: list[str] | str 
     issuer: str | None = None
     credentialSubject: dict[str, Any]
-    # Permitimos campos extra por si metemos @context o credentialSchema
-    model_config = {"extra": "allow"}
+    credentialSchema: CredentialSchema | list[CredentialSchema] | None = None
+
+# Esquema (simulado) del Trusted Schemas Registry de EBSI que se inyecta si falta.
+# Constante de módulo compartida entre peticiones: no se debe mutar (dict plano, y no
+# MappingProxyType, porque acaba serializado en el JWT).
+_EBSI_SCHEMA: Final[dict[str, str]] = {
+    "id": "https://api.preprod.ebsi.eu/trusted-schemas-registry/v1/schemas/0x123...",
+    "type": "JsonSchemaValidator2018",
+}
 
 # --- ENDPOINTS ---
 
 @router.get("", response_class=HTMLResponse)
-async def issuer_page(request: Request):
-    return templates.TemplateResponse("issuer.html", {"request": request})
+async def issuer_page():
+    # Página sin datos por usuario: HTML renderizado una vez y cacheable por el navegador
+    return HTMLResponse(render_static("issuer.html"), headers=STATIC_PAGE_HEADERS)
 
 # --- NUEVO ENDPOINT OCR ---
 @router.post("/ocr")
-async def process_ocr(file: UploadFile = File(...)):
+async def process_ocr(request: Request, file: UploadFile = File(...)):
     """Recibe una imagen, extrae texto e intenta adivinar dorsal y tiempo."""
-    if not file.content_type.startswith("image/"):
+    if not (file.content_type or "").startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
-    
-    content = await file.read()
-    data = extract_race_data(content)
+
+    # Starlette ya ha volcado la subida a un SpooledTemporaryFile (a disco por encima de 1 MB)
+    if file.size is not None and file.size > OCR_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="La imagen supera el tamaño máximo permitido")
+
+    # El worker es otro proceso: le enviamos los bytes (acotados por OCR_MAX_UPLOAD_BYTES)
+    image_bytes = await file.read()
+    # Fuera del event loop: el resto de peticiones siguen atendiéndose mientras dura el OCR
+    data = await run_ocr(request, image_bytes)
     
     return data
 # ---------------------------
 
 @router.post("/issue")
 async def issue(
+    request: Request,
     db: DBDep,
     vc: VCModel = Body(...),
     ttl: int = Query(3600, ge=60, le=31536000), 
     subject_did: str = Query(..., alias="subject_did"),
 ):
     try:
-        vc_dict = vc.model_dump() if hasattr(vc, "model_dump") else vc.dict()
-        
+        # by_alias: el contexto se serializa como "@context"; exclude_none omite los opcionales vacíos
+        vc_dict = vc.model_dump(mode="python", exclude_none=True, by_alias=True)
+
         # --- MEJORA EBSI: Inyección de Esquema ---
         # Aseguramos que la credencial cumple con estándares europeos simulados
-        if "credentialSchema" not in vc_dict:
-            vc_dict["credentialSchema"] = {
-                "id": "https://api.preprod.ebsi.eu/trusted-schemas-registry/v1/schemas/0x123...",
-                "type": "JsonSchemaValidator2018"
-            }
+        vc_dict.setdefault("credentialSchema", _EBSI_SCHEMA)
         # -----------------------------------------
 
-        res = issue_vc_jwt(vc_dict, subject_did=subject_did, ttl=ttl)
+        # Firma fuera del event loop (pool de hilos de la app)
+        res = await asyncio.get_running_loop().run_in_executor(
+            _app_pool(request, "crypto_pool"), issue_vc_jwt, vc_dict, subject_did, ttl
+        )
     
     except FileNotFoundError as e:
         raise HTTPException(status_code=500, detail=f"Configuración de claves incompleta: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    cred = Credential(
-        jti=res["jti"], 
-        token=res["token"], 
-        status="valid"
+    # INSERT directo (Core): sin objeto ORM ni unit-of-work para una fila que no volvemos a leer
+    await db.execute(
+        insert(Credential).values(jti=res["jti"], token=res["token"], status="valid")
     )
-    db.add(cred)
     await db.commit()
 
     subject_data = res["claims"].get("vc", {}).get("credentialSubject", {})
@@ -1,27 +1,24 @@
 from __future__ import annotations
 import secrets
 from datetime import datetime, timedelta, timezone
-from pathlib import Path
 from typing import Annotated
 
-from fastapi import APIRouter, Body, Query, Depends, Request
+from fastapi import APIRouter, Body, Query, Depends
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services.vc import verify_jwt
+from app.services.credentials import get_credential
+from app.services.nonces import nonce_writer
 from app.db.session import get_db
-from app.db.models import Nonce, Credential
+from app.db.models import Nonce
+from app.templating import STATIC_PAGE_HEADERS, render_static
 
 # --- CONFIGURACIÓN ---
 router = APIRouter(prefix="/verifier", tags=["verifier"])
 
-BASE_DIR = Path(__file__).resolve().parents[1]
-TEMPLATES_DIR = BASE_DIR / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-
 # --- DEPENDENCIES ---
 DBDep = Annotated[AsyncSession, Depends(get_db)]
 
@@ -33,8 +30,9 @@ class VerifyRequest(BaseModel):
 # --- ENDPOINTS ---
 
 @router.get("", response_class=HTMLResponse, summary="Interfaz del Verificador")
-async def verifier_page(request: Request):
-    return templates.TemplateResponse("verifier.html", {"request": request})
+async def verifier_page():
+    # Página sin datos por usuario: HTML renderizado una vez y cacheable por el navegador
+    return HTMLResponse(render_static("verifier.html"), headers=STATIC_PAGE_HEADERS)
 
 @router.get("/challenge", summary="Generar Reto (Anti-Replay)")
 async def challenge(db: DBDep, ttl: int = Query(60, ge=5, le=600)):
@@ -51,13 +49,17 @@ async def challenge(db: DBDep, ttl: int = Query(60, ge=5, le=600)):
     now_utc = datetime.now(timezone.utc)
     expires_at = now_utc + timedelta(seconds=ttl)
     
-    # 3. Persistir el reto
-    db.add(Nonce(value=value, expires_at=expires_at))
-    await db.commit()
+    # 3. Persistir el reto (agrupado con los de otras peticiones concurrentes si el
+    #    writer está activo; si no, p.ej. sin lifespan, insert directo)
+    if nonce_writer.running:
+        await nonce_writer.add(value, expires_at)
+    else:
+        db.add(Nonce(value=value, expires_at=expires_at))
+        await db.commit()
     
     return {
         "nonce": value, 
-        "expiresAt": expires_at.isoformat(), 
+        "expiresAt": expires_at, # orjson lo emite en ISO 8601 con zona horaria
         "ttl": ttl
     }
 
@@ -68,7 +70,7 @@ async def verify(body: VerifyRequest, db: DBDep):
     Verifica Criptografía + Integridad del Nonce + Estado de Revocación.
     """
     # --- A. VERIFICACIÓN CRIPTOGRÁFICA (Capa SSI/DID) ---
-    # Llama al servicio que resuelve el DID (Web o EBSI) y valida la firma RS256
+    # Llama al servicio que resuelve el DID (Web o EBSI) y valida la firma (EdDSA/RS256)
     crypto_check = verify_jwt(body.token)
     
     if not crypto_check["ok"]:
@@ -79,42 +81,40 @@ async def verify(body: VerifyRequest, db: DBDep):
 
     # --- B. VERIFICACIÓN ANTI-REPLAY (Capa Protocolo) ---
     if body.nonce:
-        # Usamos una transacción explícita para asegurar lectura consistente
-        # Nota: En SQLite el aislamiento es SERIALIZABLE por defecto en escrituras.
-        q = select(Nonce).where(Nonce.value == body.nonce)
-        nonce_row = (await db.execute(q)).scalar_one_or_none()
-        
         now_utc = datetime.now(timezone.utc)
-        
-        if not nonce_row:
-            return _fail("nonce_invalid", {"msg": "Nonce desconocido o falso."})
-        
-        # PREVENCIÓN DE DOBLE GASTO (RACE CONDITION CHECK)
-        if nonce_row.consumed_at is not None:
-            return _fail("nonce_used", {"msg": "Este reto ya fue utilizado. Posible ataque de repetición."})
-        
-        # Validación de TTL
-        db_expire = nonce_row.expires_at
-        if db_expire.tzinfo is None:
-            db_expire = db_expire.replace(tzinfo=timezone.utc)
-
-        if db_expire < now_utc:
-            return _fail("nonce_expired", {"msg": "El tiempo del reto ha expirado."})
-            
-        # CONSUMO ATÓMICO
-        nonce_row.consumed_at = now_utc
+
+        # CONSUMO ATÓMICO (UPDATE ... RETURNING): el propio WHERE comprueba que el nonce
+        # existe, no está consumido y no ha caducado. Dos verificaciones concurrentes no
+        # pueden gastar el mismo reto y nos ahorramos el SELECT previo.
+        stmt = (
+            update(Nonce)
+            .where(
+                Nonce.value == body.nonce,
+                Nonce.consumed_at.is_(None),
+                Nonce.expires_at > now_utc,
+            )
+            .values(consumed_at=now_utc)
+            .returning(Nonce.value)
+        )
         try:
+            consumed = (await db.execute(stmt)).scalar_one_or_none()
             await db.commit()
         except Exception:
             # Si ocurre un error de concurrencia al commit, rechazamos
             await db.rollback()
             return _fail("concurrency_error", {"msg": "Conflicto de concurrencia al consumir nonce."})
 
+        if consumed is None:
+            # Solo en el camino de error averiguamos el motivo (segunda consulta)
+            return await _nonce_rejection(db, body.nonce)
+
     # --- C. VERIFICACIÓN DE ESTADO (Capa de Ciclo de Vida) ---
     if not jti:
         return _fail("malformed", {"reason": "El token no tiene JTI"})
 
-    cred = (await db.execute(select(Credential).where(Credential.jti == jti))).scalar_one_or_none()
+    # Estado leído siempre de la BD (lectura proyectada por JTI, sin caché en memoria):
+    # una credencial revocada se rechaza en cuanto se confirma la revocación
+    cred = await get_credential(db, jti)
     
     # Si no existe en nuestra BD (puede ser externo o error)
     if not cred:
@@ -142,8 +142,8 @@ async def verify_by_scan(jti: str, db: DBDep):
     Al leer el QR (que contiene el JTI), el sistema recupera el token original
     y lo re-verifica.
     """
-    # 1. Recuperar token de BD
-    cred = (await db.execute(select(Credential).where(Credential.jti == jti))).scalar_one_or_none()
+    # 1. Recuperar token y estado (una lectura por JTI, siempre de la BD)
+    cred = await get_credential(db, jti)
     
     if not cred:
         return _fail("not_found", {"msg": "Credencial no encontrada."})
@@ -165,6 +165,21 @@ async def verify_by_scan(jti: str, db: DBDep):
         "claims": crypto_check["payload"]
     }
 
+async def _nonce_rejection(db: AsyncSession, value: str):
+    """Diagnostica por qué no se pudo consumir un nonce (desconocido, usado o caducado)."""
+    q = select(Nonce.consumed_at).where(Nonce.value == value)
+    row = (await db.execute(q)).first()
+
+    if row is None:
+        return _fail("nonce_invalid", {"msg": "Nonce desconocido o falso."})
+
+    # PREVENCIÓN DE DOBLE GASTO
+    if row.consumed_at is not None:
+        return _fail("nonce_used", {"msg": "Este reto ya fue utilizado. Posible ataque de repetición."})
+
+    # Existe y no está consumido: el WHERE lo descartó por caducidad (TTL)
+    return _fail("nonce_expired", {"msg": "El tiempo del reto ha expirado."})
+
 def _fail(flag: str, details: dict):
     """Helper para estructurar respuestas de rechazo consistentes."""
     return {
@@ -13,7 +13,8 @@ class Credential(Base):
     jti: Mapped[str] = mapped_column(String(128), primary_key=True, unique=True)
     token: Mapped[str] = mapped_column(Text, nullable=False)
     status: Mapped[str] = mapped_column(String(16), default="valid", index=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # Indexado: es la clave de ORDER BY del panel de administración
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
 
     def __repr__(self) -> str:
         return f"<Credential(jti='{self.jti}', status='{self.status}')>"
@@ -23,7 +24,8 @@ class Nonce(Base):
     
     # Al ser PK, la base de datos impedirá físicamente insertar duplicados.
     value: Mapped[str] = mapped_column(String(64), primary_key=True)
-    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # Indexado: ORDER BY del panel de administración y barridos por caducidad
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
     consumed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
 
     def __repr__(self) -> str:
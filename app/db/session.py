@@ -2,7 +2,9 @@ from __future__ import annotations
 import os
 from collections.abc import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
 
 # --- CONFIGURACIÓN DE CONEXIÓN ---
@@ -13,15 +15,55 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./dap.db")
 # Configuración específica para SQLite en entornos multihilo/async
 connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 
+# --- POOL DE CONEXIONES ---
+# Los valores por defecto (5 + 10 de overflow, sin pre-ping) se quedan cortos con
+# tráfico concurrente de admin/holder: las peticiones acaban esperando conexión.
+# Una BD SQLite en memoria usa StaticPool (una sola conexión) y no admite estos
+# parámetros, así que solo se aplican a BDs en fichero o servidor.
+def _pool_options(url: str) -> dict:
+    if ":memory:" in url or url.rstrip("/").endswith("sqlite+aiosqlite:"):
+        return {}
+    return {
+        # Explícito: conexiones aiosqlite de larga vida (hilo + fichero abiertos, caché de
+        # páginas de SQLite caliente) en lugar de reconectar en cada petición
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        # Descarta conexiones muertas antes de entregarlas (reinicios del servidor de BD)
+        "pool_pre_ping": True,
+        # Recicla conexiones viejas antes de que las cierre el servidor por inactividad
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
 # --- MOTOR DE BASE DE DATOS (ENGINE) ---
 engine = create_async_engine(
     DATABASE_URL,
     connect_args=connect_args,
+    **_pool_options(DATABASE_URL),
     # 'echo=True' permite ver las SQL queries en la consola (útil para depuración)
     echo=os.getenv("SQL_ECHO", "0").lower() in ("1", "true", "yes"),
     future=True, # Activa compatibilidad estricta con SQLAlchemy 2.0
 )
 
+# --- PRAGMAS DE SQLITE ---
+# Se aplican a cada conexión nueva del pool (son por conexión, salvo journal_mode).
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL: los lectores no se bloquean con las escrituras y cada commit es un append
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Con WAL, NORMAL solo hace fsync en los checkpoints (no en cada commit) sin riesgo de corrupción
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        # Tablas temporales (ORDER BY sin índice, etc.) en RAM en lugar de en disco
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        # Lecturas vía mmap (256 MiB): las páginas se sirven desde la caché del kernel sin copiar
+        cursor.execute("PRAGMA mmap_size=268435456")
+        # Caché de páginas propia de cada conexión: 64 MiB (valor negativo = KiB)
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
 # --- FÁBRICA DE SESIONES (SESSION FACTORY) ---
 SessionLocal = async_sessionmaker(
     bind=engine,
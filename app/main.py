@@ -1,29 +1,44 @@
 from __future__ import annotations
+import asyncio
 import os
 import pathlib
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from sqlalchemy import text
 
 from app.db.session import engine, Base
 from app.api import issuer, holder, verifier, admin
+from app.templating import (
+    STATIC_PAGE_HEADERS,
+    TEMPLATES_DIR,
+    render_static,
+    warm_up as warm_up_templates,
+)
+from app.services.vc import warm_up_keys
+from app.services.nonces import nonce_writer, run_sweeper
 
 # --- 1. CONFIGURACIÓN ROBUSTA DE RUTAS ---
 # Usamos pathlib para garantizar que las rutas funcionen igual en Windows, Linux y Docker.
 # .resolve().parent nos da la ruta absoluta de la carpeta 'app', sin importar desde dónde se ejecute.
 BASE_DIR = pathlib.Path(__file__).resolve().parent
-TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
 # Auto-creación de directorios para evitar errores en el primer despliegue
 TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
 
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+def _create_missing_indexes(sync_conn) -> None:
+    """
+    create_all no toca tablas que ya existen, así que una BD creada con una versión
+    anterior no recibiría los índices nuevos. Los creamos aquí si faltan.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
 
 # --- 2. GESTIÓN DEL CICLO DE VIDA (LIFESPAN) ---
 # Este es el estándar moderno de FastAPI (v0.93+) para manejar recursos de inicio/cierre.
@@ -37,21 +52,47 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         # Crea las tablas automáticamente si no existen (Auto-migration para el MVP)
         await conn.run_sync(Base.metadata.create_all)
-        # 'Heartbeat': Ejecutamos una query simple para asegurar que la BD está viva
-        await conn.execute(text("SELECT 1"))
+        # create_all ya es la prueba de conectividad: no hace falta un 'SELECT 1' extra
+        await conn.run_sync(_create_missing_indexes)
+
+    # Compilamos las plantillas antes de aceptar tráfico (la 1ª petición no paga el parseo)
+    warm_up_templates()
+    # Y la clave pública del emisor (resolución DID + parseo PEM)
+    warm_up_keys()
+
+    # Procesos de OCR (se arrancan bajo demanda, con la primera imagen)
+    app.state.ocr_pool = issuer.create_ocr_pool()
+    # Hilos para la firma de credenciales
+    app.state.crypto_pool = issuer.create_crypto_pool()
+
+    # Escritura agrupada de nonces (/verifier/challenge)
+    nonce_writer.start()
+    # Limpieza periódica de nonces caducados (la tabla no crece sin límite)
+    sweeper = asyncio.create_task(run_sweeper(), name="nonce-sweeper")
     
     yield # Aquí la aplicación comienza a funcionar
     
     # --- SHUTDOWN (Al pulsar Ctrl+C o parar el contenedor) ---
+    sweeper.cancel()
+    with suppress(asyncio.CancelledError):
+        await sweeper
+    await nonce_writer.stop()
     # Cerramos el pool de conexiones limpiamente para evitar fugas de recursos
     await engine.dispose()
+    # Y los procesos de OCR (sin esperar a trabajos pendientes: el servidor ya no responde).
+    # Se retiran de app.state: un pool cerrado no debe quedar a la vista de los endpoints.
+    app.state.ocr_pool.shutdown(wait=False, cancel_futures=True)
+    app.state.crypto_pool.shutdown(wait=False, cancel_futures=True)
+    del app.state.ocr_pool, app.state.crypto_pool
 
 # --- 3. DEFINICIÓN DE LA API ---
 app = FastAPI(
     title="DAP v1.3 — Digital Athlete Passport",
     description="Infraestructura SSI para certificación deportiva (Issuer/Holder/Verifier).",
     version="1.3.0",
-    lifespan=lifespan # Inyectamos la lógica de inicio/cierre definida arriba
+    lifespan=lifespan, # Inyectamos la lógica de inicio/cierre definida arriba
+    # Todas las respuestas JSON se serializan con orjson (C/Rust, datetime nativo)
+    default_response_class=ORJSONResponse,
 )
 
 # Montamos la carpeta 'static' para servir CSS/Imágenes
@@ -66,15 +107,23 @@ app.include_router(admin.router)    # Gestión y Revocación
 
 # --- 5. ENDPOINTS GLOBALES ---
 
-@app.get("/")
-def index(request: Request):
+@app.get("/", response_class=HTMLResponse)
+def index():
     """Renderiza la Landing Page (punto de entrada visual)."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(render_static("index.html"), headers=STATIC_PAGE_HEADERS)
+
+# Respuesta del favicon creada una sola vez: es inmutable y el navegador la pide en cada pestaña
+_FAVICON_RESPONSE = Response(status_code=204, headers={"Cache-Control": "public, max-age=86400"})
 
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
     """Evita errores 404 molestos en los logs del navegador."""
-    return PlainTextResponse("", status_code=204)
+    return _FAVICON_RESPONSE
+
+# Los orquestadores sondean /health cada pocos segundos: un OK reciente se reutiliza
+# durante esta ventana en lugar de volver a consultar la BD.
+HEALTH_CACHE_SECONDS = 5.0
+_last_health_ok = 0.0
 
 @app.get("/health")
 async def health():
@@ -82,9 +131,16 @@ async def health():
     Endpoint de salud para orquestadores (Docker/K8s).
     Comprueba conexión real a BD, no solo que el servidor HTTP responda.
     """
+    global _last_health_ok
+    if time.monotonic() - _last_health_ok < HEALTH_CACHE_SECONDS:
+        return {"status": "ok", "db": "connected", "version": "1.3.0"}
+
     try:
-        async with engine.begin() as conn:
+        # connect() y no begin(): un SELECT 1 no necesita BEGIN/COMMIT alrededor
+        async with engine.connect() as conn:
             await conn.execute(text("SELECT 1"))
+        _last_health_ok = time.monotonic()
         return {"status": "ok", "db": "connected", "version": "1.3.0"}
     except Exception as e:
+        # Los errores no se cachean: el siguiente sondeo vuelve a comprobar
         return {"status": "error", "db_error": str(e)}
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# --- CACHÉ EN MEMORIA (LRU + TTL) ---
+# El despliegue del MVP es un único proceso uvicorn (ver Dockerfile), así que una
+# caché en memoria cubre el mismo papel que Redis sin añadir infraestructura.
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Caché LRU acotada con caducidad opcional por entrada.
+    ttl=None significa que las entradas no caducan (solo se expulsan por tamaño).
+    Es segura entre hilos: el OCR y el threadpool de Starlette también la usan.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Guarda un valor. `ttl` permite sobrescribir la caducidad por defecto de la caché."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# --- INSTANCIAS COMPARTIDAS ---
+# PNG del QR por JTI. El contenido es inmutable por JTI: sin TTL, se invalida al revocar.
+qr_png_cache = TTLCache(maxsize=2048)
+
+# HTML final de /admin/ui por (usuario, limit, offset). TTL corto: el panel se refresca
+# a mano o por polling; /admin/revoke la vacía para que los cambios se vean al momento.
+admin_html_cache = TTLCache(maxsize=64, ttl=15)
+
+# Clave pública (PEM) por DID del emisor. En producción la resolución es HTTPS/on-chain;
+# el TTL acota cuánto tarda en verse una rotación de claves publicada en el DID Document.
+did_key_cache = TTLCache(maxsize=1024, ttl=300)
+
+# Resultados OK de verify_jwt por hash del token; el TTL de cada entrada lo fija su 'exp'
+verify_cache = TTLCache(maxsize=4096)
+
+# Resultado del OCR por hash del contenido de la imagen: reintentos y re-subidas de la
+# misma foto no vuelven a pasar por Tesseract. Solo se guardan resultados sin error.
+ocr_result_cache = TTLCache(maxsize=512, ttl=24 * 3600)
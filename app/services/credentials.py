@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Credential
+from app.services.cache import qr_png_cache
+
+# --- LECTURA DE CREDENCIALES POR JTI ---
+# Columnas que necesitan los endpoints de lectura (holder QR/JSON, verifier)
+_CREDENTIAL_COLUMNS = (Credential.jti, Credential.token, Credential.status)
+
+
+async def get_credential(db: AsyncSession, jti: str) -> Row | None:
+    """
+    Devuelve la fila (jti, token, status) de una credencial, o None si no existe.
+    Una sola lectura proyectada por clave primaria. No se cachea en memoria: el estado
+    (revocación) tiene que verse al momento en cualquier proceso, y con él ya hay que
+    ir a la BD, así que el token viene en la misma consulta.
+    """
+    stmt = select(*_CREDENTIAL_COLUMNS).where(Credential.jti == jti)
+    return (await db.execute(stmt)).first()
+
+
+def invalidate_credential(jti: str) -> None:
+    """Libera el QR cacheado de un JTI (se llama tras revocar: ya no se va a servir)."""
+    qr_png_cache.pop(jti)
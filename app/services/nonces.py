@@ -0,0 +1,139 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+
+from app.db.models import Nonce
+from app.db.session import engine
+
+logger = logging.getLogger(__name__)
+
+# --- ESCRITURA AGRUPADA DE NONCES (group commit) ---
+# Cada /verifier/challenge inserta un nonce. Con tráfico concurrente, en lugar de una
+# transacción (y un fsync) por petición, un único task escribe en bloque todos los
+# nonces que se hayan acumulado mientras se confirmaba el lote anterior.
+# No se pre-generan nonces: cada reto conserva el TTL pedido por el cliente.
+
+
+class NonceWriter:
+    """
+    Agrupa los INSERT de nonces de peticiones concurrentes en una sola transacción.
+    add() no vuelve hasta que el nonce está confirmado en BD, así que un /verify
+    inmediatamente posterior siempre lo encuentra.
+    """
+
+    def __init__(self, max_batch: int = 256):
+        self.max_batch = max_batch
+        # None en la cola es la señal de parada (ver stop())
+        self._queue: asyncio.Queue[tuple[str, datetime, asyncio.Future] | None] | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="nonce-writer")
+
+    async def stop(self) -> None:
+        """Confirma todo lo que ya estaba en cola y detiene el task."""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._queue.put(None)
+        try:
+            await self._task
+        finally:
+            self._task = None
+
+    async def add(self, value: str, expires_at: datetime) -> None:
+        if not self.running:
+            raise RuntimeError("NonceWriter no está en marcha")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((value, expires_at, future))
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            # Esperamos al primero y nos llevamos todo lo que ya esté en cola (sin esperas extra)
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._write_batch(batch)
+            if stop:
+                return
+
+    async def _write_batch(self, batch: list[tuple[str, datetime, asyncio.Future]]) -> None:
+        """Un lote = una transacción. Si falla, fallan todos los add() que esperan por él."""
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(Nonce),
+                    [{"value": value, "expires_at": expires_at} for value, expires_at, _ in batch],
+                )
+        except asyncio.CancelledError:
+            for *_, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+
+# --- LIMPIEZA DE NONCES CADUCADOS ---
+# Los nonces caducados se conservan un tiempo (NONCE_RETENTION segundos) para que /verify
+# pueda seguir respondiendo "nonce_expired"/"nonce_used" en lugar de "nonce_invalid".
+NONCE_RETENTION = int(os.getenv("NONCE_RETENTION", "3600"))
+SWEEP_INTERVAL = 60
+# Borrado por lotes: ninguna transacción de limpieza retiene el lock de escritura mucho tiempo
+SWEEP_BATCH = 5000
+
+
+async def sweep_expired_nonces(now: datetime | None = None) -> int:
+    """Borra los nonces caducados hace más de NONCE_RETENTION segundos. Devuelve cuántos."""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=NONCE_RETENTION)
+    expired = select(Nonce.value).where(Nonce.expires_at < cutoff).limit(SWEEP_BATCH)
+    total = 0
+    while True:
+        async with engine.begin() as conn:
+            deleted = (await conn.execute(delete(Nonce).where(Nonce.value.in_(expired)))).rowcount
+        total += deleted
+        if deleted < SWEEP_BATCH:
+            return total
+
+
+async def run_sweeper(interval: float = SWEEP_INTERVAL) -> None:
+    """Bucle de limpieza periódica (task de fondo lanzado en el lifespan)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_expired_nonces()
+        except Exception:
+            # Un fallo puntual (BD bloqueada, etc.) no debe matar el bucle
+            logger.exception("Limpieza de nonces fallida")
+
+
+# --- INSTANCIA COMPARTIDA ---
+# Se arranca y se para en el lifespan (app/main.py)
+nonce_writer = NonceWriter()
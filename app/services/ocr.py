@@ -2,51 +2,211 @@ from __future__ import annotations
 import os
 import re
 import io
-import pytesseract
-from PIL import Image
+import shutil
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+# Tesseract usa OpenMP internamente: con varias peticiones en paralelo los hilos de
+# OpenMP compiten entre sí. Un hilo por llamada escala mejor (debe fijarse antes de cargar libtesseract).
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# --- CARGA DIFERIDA ---
+# PIL y libtesseract solo se cargan en los procesos que hacen OCR (el pool de issuer.py):
+# el proceso de la API importa este módulo pero no paga esas importaciones.
+@lru_cache(maxsize=1)
+def _pil():
+    from PIL import Image
+    return Image
+
+# Motor en proceso (opcional): tesserocr enlaza libtesseract directamente, sin lanzar
+# un subproceso ni escribir la imagen a disco en cada llamada. Si no está instalado
+# usamos pytesseract (binario 'tesseract' en el PATH), que solo se importa si hace falta.
+@lru_cache(maxsize=1)
+def _tesserocr():
+    try:
+        import tesserocr
+    except ImportError:
+        return None
+    return tesserocr
+
+OCR_LANG = "spa+eng"
 
 # --- CONFIGURACIÓN TESSERACT ---
-# Detectamos si estamos en Windows para desarrollo local.
-# En Docker (Linux), no entra en el 'if' y usa el PATH del sistema automáticamente.
-if os.name == 'nt':
-    POSSIBLE_PATHS = [
-        r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-        r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-        r"C:\Users\Public\Tesseract-OCR\tesseract.exe"
-    ]
+# Rutas del instalador en Windows, para desarrollo local (el instalador no toca el PATH).
+# En Docker (Linux) no se usan: el binario está en el PATH del sistema.
+POSSIBLE_PATHS = (
+    r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+    r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+    r"C:\Users\Public\Tesseract-OCR\tesseract.exe",
+)
+
+@lru_cache(maxsize=1)
+def _configure_tesseract() -> str | None:
+    """
+    Localiza el binario de Tesseract una sola vez, en el primer OCR (no al importar).
+    Devuelve su ruta absoluta (pytesseract ya no busca en el PATH en cada subproceso),
+    o None si no se encuentra.
+    """
+    path = shutil.which("tesseract")
+    if path or os.name != 'nt':
+        return path
     for path in POSSIBLE_PATHS:
         if os.path.exists(path):
-            pytesseract.pytesseract.tesseract_cmd = path
-            # Fix para versiones antiguas de Tesseract en Windows
+            # Fix para versiones antiguas de Tesseract en Windows (también lo lee tesserocr)
             os.environ["TESSDATA_PREFIX"] = os.path.dirname(path)
             print(f"✅ OCR (Windows): Motor vinculado en {path}")
+            return path
+    return None
+
+# --- MOTOR OCR ---
+@lru_cache(maxsize=1)
+def _pytesseract():
+    """Fallback por subproceso: se importa y configura una sola vez, y solo sin tesserocr."""
+    import pytesseract
+
+    tesseract_cmd = _configure_tesseract()
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return pytesseract
+
+# Una instancia de PyTessBaseAPI por hilo: no es thread-safe, y así las llamadas
+# concurrentes no se serializan detrás de un lock.
+_local = threading.local()
+
+def _tess_api():
+    api = getattr(_local, "api", None)
+    if api is None:
+        tesserocr = _tesserocr()
+        # psm SINGLE_BLOCK equivale a '--psm 6'; oem LSTM_ONLY a '--oem 1'
+        api = tesserocr.PyTessBaseAPI(
+            lang=OCR_LANG, psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.LSTM_ONLY
+        )
+        api.SetVariable("tessedit_do_invert", "0")
+        _local.api = api
+    return api
+
+# --- PREPROCESADO (binarización) ---
+# Lado largo máximo que llega a Tesseract: su coste es ~proporcional a los píxeles y,
+# a este tamaño, el texto de un dorsal sigue siendo perfectamente legible.
+OCR_MAX_DIM = int(os.getenv("OCR_MAX_DIM", "1600"))
+
+def _otsu_threshold(histogram: list[int]) -> int:
+    """
+    Umbral de Otsu sobre un histograma de 256 niveles: el corte que maximiza la
+    varianza entre clases (fondo / tinta). Recorre 256 valores, no los píxeles.
+    """
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = 0
+    weight_bg = 0
+    best_t, best_var = 0, -1.0
+    for t, h in enumerate(histogram):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
             break
+        sum_bg += t * h
+        diff = sum_bg / weight_bg - (sum_all - sum_bg) / weight_fg
+        var_between = weight_bg * weight_fg * diff * diff
+        if var_between > best_var:
+            best_t, best_var = t, var_between
+    return best_t
+
+def _preprocess(image: Image.Image) -> Image.Image:
+    """
+    Escala de grises -> (reducción a OCR_MAX_DIM si es grande) -> binarización de Otsu.
+    Todo el trabajo por píxel lo hace PIL en C (histogram, thumbnail, point con LUT);
+    Tesseract recibe una imagen ya limpia y se salta su propio umbralizado.
+    """
+    if image.format == "JPEG":
+        # libjpeg decodifica directamente en gris y a 1/2, 1/4 o 1/8 de resolución (sin
+        # pasar de OCR_MAX_DIM): nos ahorramos casi toda la IDCT de una foto de móvil
+        image.draft('L', (OCR_MAX_DIM, OCR_MAX_DIM))
+    image = image.convert('L')
+    if max(image.size) > OCR_MAX_DIM:
+        # thumbnail reduce primero por bloques enteros y luego remuestrea con Lanczos
+        image.thumbnail((OCR_MAX_DIM, OCR_MAX_DIM), _pil().Resampling.LANCZOS)
+    t = _otsu_threshold(image.histogram())
+    return image.point([255 if i > t else 0 for i in range(256)])
+
+# --- ENDEREZADO (deskew) ---
+# Fotos de dorsales hechas a mano: inclinaciones de unos pocos grados son lo habitual.
+MAX_SKEW_DEGREES = 10
+# Lado largo de la miniatura usada para estimar el ángulo (la búsqueda no necesita más)
+_SKEW_PROBE_SIZE = 400
+
+def _row_profile_score(image: Image.Image, angle: float) -> float:
+    """
+    Nitidez del perfil horizontal tras rotar `angle` grados: con el texto recto las filas
+    alternan entre tinta y fondo, y la varianza de sus medias es máxima.
+    """
+    rotated = image.rotate(angle, resample=_pil().NEAREST, fillcolor=255)
+    # resize a 1 columna = media de cada fila, calculada en C
+    rows = rotated.resize((1, rotated.height), _pil().BOX).tobytes()
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows)
+
+def _estimate_skew(image: Image.Image) -> float:
+    """Ángulo (grados) que endereza el texto: búsqueda gruesa de 1° y afinado a 0.2°."""
+    probe = image.copy()
+    probe.thumbnail((_SKEW_PROBE_SIZE, _SKEW_PROBE_SIZE))
+
+    best = max(range(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + 1), key=lambda a: _row_profile_score(probe, a))
+    fine = [best + step / 5 for step in range(-4, 5)]
+    return max(fine, key=lambda a: _row_profile_score(probe, a))
+
+def _deskew(image: Image.Image) -> Image.Image:
+    """Rota la imagen binarizada para dejar las líneas de texto horizontales."""
+    angle = _estimate_skew(image)
+    if abs(angle) < 0.5:
+        return image # Ya está recta: evitamos la rotación de la imagen completa
+    return image.rotate(angle, resample=_pil().NEAREST, expand=True, fillcolor=255)
+
+def _ocr_text(image: Image.Image) -> str:
+    """Ejecuta Tesseract sobre una imagen PIL (en proceso si hay tesserocr)."""
+    if _tesserocr() is not None:
+        api = _tess_api()
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    # --psm 6 asume un bloque de texto uniforme (bueno para listas/tablas); --oem 1 solo LSTM
+    # tessedit_do_invert=0: no probar también la imagen invertida (texto oscuro sobre claro)
+    return _pytesseract().image_to_string(
+        image, config='--psm 6 --oem 1 -c tessedit_do_invert=0', lang=OCR_LANG
+    )
 
 def extract_race_data(image_bytes: bytes) -> dict:
     """
     Función principal de OCR.
-    Procesa bytes de imagen y extrae datos estructurados (Dorsal, Tiempo, Evento).
+    Procesa los bytes de una imagen y extrae datos estructurados (Dorsal, Tiempo, Evento).
     """
+    _configure_tesseract() # Solo trabaja la primera vez (antes de crear el motor)
     try:
         # 1. Pre-procesamiento de imagen
-        image = Image.open(io.BytesIO(image_bytes))
-        image = image.convert('L') # Convertir a escala de grises para mejor contraste
+        image = _pil().open(io.BytesIO(image_bytes))
+        image = _preprocess(image) # Escala de grises + binarización (mejor contraste)
+        image = _deskew(image)     # Texto horizontal: Tesseract falla con dorsales inclinados
         
         # 2. Ejecutar Motor OCR
-        # --psm 6 asume un bloque de texto uniforme (bueno para listas/tablas)
-        text = pytesseract.image_to_string(image, config='--psm 6', lang='spa+eng')
+        text = _ocr_text(image)
         
         # Log para depuración en la consola de Docker
         print(f"\n--- [OCR] Texto crudo detectado ---\n{text.strip()[:100]}...\n-----------------------------------")
 
-        # 3. Extracción de datos (Lógica Regex)
+        # 3. Extracción de datos (Lógica Regex, una pasada)
+        fields = _parse_fields(text)
         return {
             "raw_text": text.strip(),
             "event": _find_event(text),
-            "bib": _find_dorsal(text),     # 'bib' es el nombre estándar para dorsal
-            "time": _find_time(text),
+            "bib": fields["bib"],          # 'bib' es el nombre estándar para dorsal
+            "time": fields["time"],
             # Opcional: Nombre si lo detectamos
-            "name": _find_name(text)
+            "name": fields["name"]
         }
 
     except Exception as e:
@@ -61,43 +221,57 @@ def extract_race_data(image_bytes: bytes) -> dict:
         }
 
 # --- FUNCIONES AUXILIARES (HELPERS) ---
+# El evento es la línea completa que contiene "HYROX": buscamos el literal y
+# extendemos hasta los saltos de línea, en vez de probar '.*hyrox.*' en cada posición.
+_RE_HYROX = re.compile(r'(?i)hyrox')
 
-def _find_event(text: str) -> str | None:
-    # Busca la palabra HYROX o similares
-    match = re.search(r'(?i).*(hyrox).*', text)
-    if match:
-        return match.group(0).strip()
-    return None
+# Resto de campos en UNA sola pasada sobre el texto: una alternancia con grupos con nombre.
+# Cada alternativa va dentro de un lookahead, así no consume texto: un nombre que se
+# extiende hasta la línea siguiente no "tapa" la etiqueta de tiempo o dorsal que hay en
+# ella, y el resultado coincide con buscar cada patrón por separado. Las alternativas no
+# pueden empezar en la misma posición (etiquetas distintas; HH:MM:SS frente a 3-5 cifras).
+_RE_FIELDS = re.compile(
+    r'(?i)(?='
+    r'(?:tiempo|time)[:\.\s]+(?P<time_lbl>\d{1,2}:\d{2}(?::\d{2})?)'
+    r'|\b(?P<time_fb>\d{1,2}:\d{2}:\d{2})\b'
+    r'|(?:dorsal|bib|number)[:\.\s]+(?P<bib_lbl>\d+)'
+    r'|\b(?P<bib_fb>\d{3,5})\b'
+    r'|(?:nombre|name|atleta|athlete)[:\.\s]+(?P<name>[a-zA-Z\s\.]+)'
+    r')'
+)
+# Campos con etiqueta explícita: cuando están los tres, los fallbacks ya no importan
+_LABELS = ("time_lbl", "bib_lbl", "name")
 
-def _find_time(text: str) -> str | None:
-    # 1. Busca etiqueta explícita "Tiempo: HH:MM:SS"
-    match = re.search(r'(?i)(?:tiempo|time)[:\.\s]+(\d{1,2}:\d{2}(:\d{2})?)', text)
-    if match:
-        return match.group(1)
-    
-    # 2. Fallback: Busca formato de hora aislado (HH:MM:SS)
-    fallback = re.search(r'\b(\d{1,2}:\d{2}:\d{2})\b', text)
-    if fallback:
-        return fallback.group(1)
-    return None
+def _find_event(text: str) -> str | None:
+    # Busca la palabra HYROX y devuelve su línea
+    match = _RE_HYROX.search(text)
+    if not match:
+        return None
+    start = text.rfind("\n", 0, match.start()) + 1
+    end = text.find("\n", match.end())
+    return text[start:end if end != -1 else len(text)].strip()
 
-def _find_dorsal(text: str) -> str | None:
-    # 1. Busca etiqueta explícita "Dorsal: 123"
-    match = re.search(r'(?i)(?:dorsal|bib|number)[:\.\s]+(\d+)', text)
-    if match:
-        return match.group(1)
-    
-    # 2. Fallback: Busca números de 3 a 5 cifras
-    # Filtramos los que empiezan por "202" para no confundirlos con el año (2024, 2025)
-    numbers = re.findall(r'\b\d{3,5}\b', text)
-    for num in numbers:
-        if not num.startswith("202"):
-            return num
-    return None
+def _parse_fields(text: str) -> dict:
+    """
+    Tiempo, dorsal y nombre en un solo recorrido del texto.
+    Prioridad: la etiqueta explícita ("Tiempo:", "Dorsal:") gana al formato suelto.
+    """
+    found = dict.fromkeys(_LABELS + ("time_fb", "bib_fb"))
+    for m in _RE_FIELDS.finditer(text):
+        key = m.lastgroup
+        if found[key] is not None:
+            continue
+        value = m.group(key)
+        # Números sueltos que empiezan por "202" suelen ser el año (2024, 2025), no el dorsal
+        if key == "bib_fb" and value.startswith("202"):
+            continue
+        found[key] = value
+        if all(found[k] is not None for k in _LABELS):
+            break
 
-def _find_name(text: str) -> str | None:
-    # Intenta buscar un nombre después de la etiqueta "Nombre:" o "Athlete:"
-    match = re.search(r'(?i)(?:nombre|name|atleta|athlete)[:\.\s]+([a-zA-Z\s\.]+)', text)
-    if match:
-        return match.group(1).strip()
-    return None
+    name = found["name"]
+    return {
+        "bib": found["bib_lbl"] or found["bib_fb"],
+        "time": found["time_lbl"] or found["time_fb"],
+        "name": name.strip() if name is not None else None,
+    }
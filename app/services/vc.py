@@ -1,167 +1,448 @@
 from __future__ import annotations
+import base64
+import hashlib
+import logging
 import os
 import time
 import uuid
 import json
-from functools import lru_cache
-from typing import Any, Dict
+from pathlib import Path
+from functools import cache, lru_cache
+from typing import Any, Dict, Final, Iterable, List, Tuple
 
 import jwt  # PyJWT
+import orjson
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
 
-# Algoritmo estándar para firmas en el ecosistema SSI (RSA con SHA-256)
-ALG = "RS256"
+from app.services.cache import did_key_cache, verify_cache
+
+# Trazas del resolutor a nivel DEBUG: en producción (INFO) ni siquiera se formatean
+logger = logging.getLogger(__name__)
+
+# --- ALGORITMOS DE FIRMA ---
+# EdDSA (Ed25519) para las claves nuevas: firma y verificación mucho más rápidas que RSA
+# y tokens más cortos. RS256 se mantiene para las claves RSA ya desplegadas.
+# El algoritmo se deduce SIEMPRE del tipo de clave (nunca de la cabecera del token).
+def _alg_for_key(key) -> str:
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return "EdDSA"
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return "RS256"
+    raise ValueError(f"Tipo de clave no soportado: {type(key).__name__}")
+
+# Emisor por defecto cuando la credencial candidata no trae 'issuer' (se lee una vez)
+DEFAULT_ISS = os.getenv("VC_ISS", "did:web:demo")
 
 # --- CACHING DE CLAVES (Optimización de Rendimiento) ---
-@lru_cache(maxsize=1)
+# Carpeta de claves por defecto (la que genera gen_keys.py)
+KEYS_DIR = Path(__file__).resolve().parent.parent / "keys"
+
+# Contenido de cada fichero de clave junto a su mtime: ruta -> (mtime_ns, bytes)
+_key_files: Dict[Path, Tuple[int, bytes]] = {}
+
+def _read_key_file_cached(path: str | Path) -> bytes:
+    """
+    Lee un fichero de clave memorizado por mtime: un solo stat por llamada y relectura
+    solo si el fichero cambió (rotación de claves sin reiniciar el proceso).
+    Lanza FileNotFoundError si no existe.
+    """
+    path = Path(path)
+    # Sin exists() previo: el propio stat lanza FileNotFoundError
+    mtime = path.stat().st_mtime_ns
+    cached = _key_files.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    data = path.read_bytes()
+    _key_files[path] = (mtime, data)
+    return data
+
+def _preload_key_dir(directory: Path = KEYS_DIR) -> None:
+    """
+    Carga de una pasada todos los .pem de la carpeta de claves (un solo os.scandir en
+    lugar de resolver y comprobar cada fichero por separado). Deja el contenido en
+    _key_files, así que la primera firma/verificación ya no lee del disco.
+    """
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.endswith(".pem") and entry.is_file():
+                path = Path(entry.path)
+                _key_files[path] = (entry.stat().st_mtime_ns, path.read_bytes())
+
+# Argumentos fijos (dos llamadas posibles) y sin argumentos: @cache sin límite evita la
+# contabilidad LRU. Los memoizadores por PEM de más abajo siguen acotados (rotaciones).
+@cache
+def _key_source(env_var: str, filename: str, allow_inline: bool) -> Path | bytes:
+    """
+    De dónde sale una clave (se decide una vez): PEM en línea en la variable de entorno
+    (bytes, solo si allow_inline) o ruta absoluta del fichero (Path).
+    """
+    value = os.getenv(env_var)
+    if allow_inline and value and not os.path.isfile(value):
+        return value.encode("utf-8")
+    return Path(value).resolve() if value else KEYS_DIR / filename
+
+@cache
+def _ephemeral_private_key() -> bytes:
+    """Par temporal para la sesión, si no hay clave en disco (evita el crash en un Docker limpio)."""
+    print("⚠️ Claves no encontradas. Generando par temporal (Ed25519)...")
+    priv = ed25519.Ed25519PrivateKey.generate()
+    return priv.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
 def _get_private_key() -> bytes:
     """Carga la clave privada del Emisor (Issuer)."""
-    env_pem = os.getenv("VC_PRIV")
-    if env_pem and not os.path.isfile(env_pem):
-        return env_pem.encode("utf-8")
-    
-    path = env_pem if env_pem else os.path.join(os.path.dirname(__file__), "..", "keys", "private.pem")
-    path = os.path.abspath(path)
-    
-    if not os.path.exists(path):
-        # Generación al vuelo si no existe (para evitar crash en Docker limpio)
-        from cryptography.hazmat.backends import default_backend
-        from cryptography.hazmat.primitives.asymmetric import rsa
-        print("⚠️ Claves no encontradas. Generando par temporal...")
-        priv = rsa.generate_private_key(65537, 2048, default_backend())
-        # Guardamos para la sesión
-        return priv.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-    
-    with open(path, "rb") as f:
-        return f.read()
+    source = _key_source("VC_PRIV", "private.pem", True)
+    if isinstance(source, bytes):
+        return source
+    try:
+        return _read_key_file_cached(source)
+    except FileNotFoundError:
+        return _ephemeral_private_key()
 
-@lru_cache(maxsize=1)
 def _get_public_key() -> bytes:
     """Carga la clave pública local."""
-    # Si generamos la privada al vuelo arriba, necesitamos derivar la pública aquí
-    # Pero para simplificar el código, asumimos que existen en disco o fallamos.
-    env_pub = os.getenv("VC_PUB")
-    path = env_pub if env_pub else os.path.join(os.path.dirname(__file__), "..", "keys", "public.pem")
-    path = os.path.abspath(path)
-
-    if not os.path.exists(path):
+    try:
+        return _read_key_file_cached(_key_source("VC_PUB", "public.pem", False))
+    except FileNotFoundError:
         # Fallback de emergencia: derivar de la privada
-        priv_pem = _get_private_key()
-        priv = serialization.load_pem_private_key(priv_pem, password=None)
-        return priv.public_key().public_bytes(
+        return _private_key_obj().public_key().public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         )
-        
-    with open(path, "rb") as f:
-        return f.read()
+
+@lru_cache(maxsize=4)
+def _private_key_from_pem(pem: bytes):
+    """
+    Parsea la clave privada UNA vez por PEM: cada emisión reutiliza el mismo objeto
+    (las claves de cryptography son inmutables) y un PEM nuevo (rotación) se parsea de nuevo.
+    """
+    # INVARIANTE: firmar siempre con este objeto compartido, nunca con un
+    # load_pem_private_key por llamada. Con RSA, OpenSSL guarda junto a la clave los
+    # contextos de Montgomery (CRT incluido) que construye en la primera firma; con un
+    # objeto nuevo por emisión se recalcularían cada vez. Firmar con el mismo objeto
+    # desde varios hilos (crypto_pool) es seguro.
+    return serialization.load_pem_private_key(pem, password=None)
+
+def _private_key_obj():
+    """Clave privada del emisor ya parseada (la del fichero vigente)."""
+    return _private_key_from_pem(_get_private_key())
+
+def _signing_alg() -> str:
+    """Algoritmo JOSE con el que firma el emisor local (según su clave privada)."""
+    return _alg_for_key(_private_key_obj())
+
+@lru_cache(maxsize=16)
+def _public_key_from_pem(pem: bytes):
+    """
+    Parsea un PEM a objeto clave pública UNA vez por PEM.
+    Evita repetir el parseo ASN.1 en cada verificación (el PEM de un DID no cambia).
+    """
+    return serialization.load_pem_public_key(pem)
+
+# --- JWKS (RFC 7517) ---
+# Miembros obligatorios de cada tipo de JWK, los que entran en la huella RFC 7638
+_THUMBPRINT_MEMBERS: Final[Dict[str, Tuple[str, ...]]] = {"OKP": ("crv", "kty", "x"), "RSA": ("e", "kty", "n")}
+
+def _public_jwk(public_key) -> Dict[str, Any]:
+    """
+    JWK de una clave pública, con 'kid' = huella RFC 7638 (SHA-256) de la propia clave.
+    El 'kid' depende solo de la clave, no del emisor: todos los tokens firmados con ella
+    llevan el mismo 'kid' en la cabecera, sea cual sea su 'iss'.
+    """
+    alg = _alg_for_key(public_key)
+    jwk = jwt.get_algorithm_by_name(alg).to_jwk(public_key, as_dict=True)
+    required = {name: jwk[name] for name in _THUMBPRINT_MEMBERS[jwk["kty"]]}
+    kid = _b64url(hashlib.sha256(orjson.dumps(required, option=orjson.OPT_SORT_KEYS)).digest()).decode("ascii")
+    return {**jwk, "alg": alg, "use": "sig", "kid": kid}
+
+@lru_cache(maxsize=4)
+def _signing_kid(private_key) -> str:
+    """'kid' de la clave privada de firma (el objeto es el memorizado por _private_key_from_pem)."""
+    return _public_jwk(private_key.public_key())["kid"]
+
+@lru_cache(maxsize=4)
+def _jwks_bytes_for(pem: bytes) -> bytes:
+    """JWKS serializado de una clave pública, una vez por PEM (una rotación genera otro)."""
+    return orjson.dumps({"keys": [_public_jwk(_public_key_from_pem(pem))]})
+
+def get_jwks_bytes() -> bytes:
+    """JWKS del emisor local ya serializado: listo para servir tal cual (/.well-known/jwks.json)."""
+    return _jwks_bytes_for(_get_public_key())
+
+def warm_up_keys() -> None:
+    """
+    Lee y parsea las claves del propio emisor (privada para firmar, pública vía su DID)
+    antes de aceptar tráfico, para que la primera emisión/verificación no pague la carga.
+    """
+    _preload_key_dir()
+    _private_key_obj()
+    resolve_did_public_key(DEFAULT_ISS)
+    get_jwks_bytes()
+
+def clear_key_caches() -> None:
+    """
+    Olvida todas las claves y verificaciones memorizadas (tests, o tras rotar claves
+    en caliente): la siguiente firma/verificación vuelve a leer y resolver.
+    """
+    for cached in (_key_source, _ephemeral_private_key, _private_key_from_pem, _public_key_from_pem,
+                   _signing_kid, _jwks_bytes_for):
+        cached.cache_clear()
+    _key_files.clear()
+    did_key_cache.clear()
+    verify_cache.clear()
 
 # --- CAPA DE ABSTRACCIÓN DE IDENTIDAD (DID RESOLVER) ---
 
-def resolve_did_public_key(did: str) -> bytes:
+def resolve_did_public_key(did: str):
     """
-    RESOLUTOR HÍBRIDO (Strategy Pattern).
-    Simula la obtención de la clave pública según el prefijo del DID.
+    Clave pública de un DID, ya deserializada y memorizada con TTL (did_key_cache):
+    las verificaciones repetidas del mismo emisor (el caso habitual) no vuelven a
+    resolver ni a parsear el PEM.
     """
-    print(f"🔍 [DID Resolver] Analizando identidad: {did}")
-    
+    key = did_key_cache.get(did)
+    if key is None:
+        key = _public_key_from_pem(_resolve_did_uncached(did))
+        did_key_cache.set(did, key)
+    return key
+
+# RESOLUTOR HÍBRIDO (Strategy Pattern): una estrategia por método DID.
+# Simulan la obtención de la clave pública; un método nuevo es una entrada más en _RESOLVERS.
+
+def _resolve_ebsi(did: str) -> bytes:
     # ESTRATEGIA 1: EBSI (Simulación Mock)
-    if did.startswith("did:ebsi:"):
-        print("   -> 🇪🇺 Detectado DID EBSI. Iniciando protocolo de simulación...")
-        print("      [MOCK] Consultando Trusted Issuer Registry (EBSI API v2)... OK")
-        print("      [MOCK] Verificando integridad on-chain... OK")
-        # TRUCO: Devolvemos la clave local para que la matemática RSA funcione,
-        # pero para el sistema parece que vino de la blockchain europea.
-        return _get_public_key()
+    logger.debug("   -> 🇪🇺 Detectado DID EBSI. Iniciando protocolo de simulación...")
+    logger.debug("      [MOCK] Consultando Trusted Issuer Registry (EBSI API v2)... OK")
+    logger.debug("      [MOCK] Verificando integridad on-chain... OK")
+    # TRUCO: Devolvemos la clave local para que la matemática de la firma funcione,
+    # pero para el sistema parece que vino de la blockchain europea.
+    return _get_public_key()
 
+def _resolve_web(did: str) -> bytes:
     # ESTRATEGIA 2: DID Web
-    if did.startswith("did:web:"):
-        print("   -> 🌐 Detectado DID Web. Resolviendo vía HTTPS (Simulado).")
-        return _get_public_key()
+    logger.debug("   -> 🌐 Detectado DID Web. Resolviendo vía HTTPS (Simulado).")
+    return _get_public_key()
 
+def _resolve_default(did: str) -> bytes:
     # FALLBACK
-    print("   -> ⚠️ DID Genérico/Local. Usando clave por defecto.")
+    logger.debug("   -> ⚠️ DID Genérico/Local. Usando clave por defecto.")
     return _get_public_key()
 
+_RESOLVERS = {"ebsi": _resolve_ebsi, "web": _resolve_web}
+
+def _resolve_did_uncached(did: str) -> bytes:
+    """PEM de la clave pública de un DID, según su método (did:<método>:...)."""
+    logger.debug("🔍 [DID Resolver] Analizando identidad: %s", did)
+    parts = did.split(":", 2)
+    method = parts[1] if len(parts) == 3 and parts[0] == "did" else ""
+    return _RESOLVERS.get(method, _resolve_default)(did)
+
 # --- LÓGICA DE NEGOCIO (EMISIÓN Y VERIFICACIÓN) ---
 
-def issue_vc_jwt(candidate_vc: Dict[str, Any], subject_did: str, ttl: int = 3600) -> Dict[str, Any]:
-    """
-    Genera una Verifiable Credential firmada.
-    **Lógica EBSI:** Si el issuer es did:ebsi, inyecta el esquema obligatorio automáticamente.
-    """
-    now = int(time.time())
-    jti = f"urn:uuid:{uuid.uuid4()}"
-    
+# Partes fijas del payload W3C, construidas una vez al importar.
+# Se comparten entre emisiones: no se deben mutar (listas y no tuplas, para que los
+# claims devueltos sean iguales a los que se leen del token).
+_VC_TEMPLATE: Final[Dict[str, Any]] = {
+    "@context": ["https://www.w3.org/2018/credentials/v1"],
+    "type": ["VerifiableCredential", "VerifiableAttestation"],
+}
+# EBSI requiere que definas qué esquema de datos usas
+_EBSI_CREDENTIAL_SCHEMA: Final[list] = [{
+    "id": "https://api.preprod.ebsi.eu/trusted-schemas-registry/v1/schemas/0x944...",
+    "type": "JsonSchemaValidator2018"
+}]
+
+def _build_claims(candidate_vc: Dict[str, Any], subject_did: str, now: int, exp: int) -> Dict[str, Any]:
+    """Claims JWT de una VC con el instante y la caducidad ya resueltos."""
     # Determinamos el Issuer
     # Si viene en el candidato lo usamos, si no, usamos uno por defecto.
-    iss = candidate_vc.get("issuer") or os.getenv("VC_ISS", "did:web:demo")
+    iss = candidate_vc.get("issuer") or DEFAULT_ISS
 
-    # LÓGICA DE SIMULACIÓN EBSI
-    credential_schema = []
+    # Construcción del Payload W3C (plantilla + campos variables)
+    vc_payload = {**_VC_TEMPLATE, "credentialSubject": candidate_vc}
+
+    # LÓGICA DE SIMULACIÓN EBSI: inyectamos el schema (solo para EBSI)
     if iss.startswith("did:ebsi:"):
-        # EBSI requiere que definas qué esquema de datos usas
-        credential_schema = [{
-            "id": "https://api.preprod.ebsi.eu/trusted-schemas-registry/v1/schemas/0x944...",
-            "type": "JsonSchemaValidator2018"
-        }]
-
-    # Construcción del Payload W3C
-    vc_payload = {
-        "@context": ["https://www.w3.org/2018/credentials/v1"],
-        "type": ["VerifiableCredential", "VerifiableAttestation"],
-        "credentialSubject": candidate_vc
-    }
-    
-    # Inyectamos el schema si existe (solo para EBSI)
-    if credential_schema:
-        vc_payload["credentialSchema"] = credential_schema
+        vc_payload["credentialSchema"] = _EBSI_CREDENTIAL_SCHEMA
 
-    full_payload = {
+    return {
         "iss": iss,
         "sub": subject_did,
-        "jti": jti,
+        # Forma URN canónica (RFC 4122, con guiones): un .hex sin guiones no sería un urn:uuid válido
+        "jti": uuid.uuid4().urn,
         "nbf": now,
         "iat": now,
-        "exp": now + int(ttl),
+        "exp": exp,
         "vc": vc_payload
     }
 
-    # Firma
-    priv_pem = _get_private_key()
-    key = serialization.load_pem_private_key(priv_pem, password=None)
-    token = jwt.encode(full_payload, key, algorithm=ALG)
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def issue_vc_jwt(candidate_vc: Dict[str, Any], subject_did: str, ttl: int = 3600) -> Dict[str, Any]:
+    """
+    Genera una Verifiable Credential firmada.
+    **Lógica EBSI:** Si el issuer es did:ebsi, inyecta el esquema obligatorio automáticamente.
+    """
+    now = int(time.time())
+    full_payload = _build_claims(candidate_vc, subject_did, now, now + int(ttl))
+
+    # Firma: el payload se serializa con orjson (C, UTF-8 directo) y se firma como bytes
+    # con la capa JWS; jwt.encode lo pasaría por json.dumps. Los claims ya son numéricos
+    # (iat/exp enteros), así que no necesitamos las conversiones de fechas de PyJWT.
+    # Cabecera: 'kid' (huella de la clave, la misma que publica el JWKS) e 'iss' replicado
+    # (RFC 7519 §5.3) para que el verificador resuelva el emisor sin decodificar el payload.
+    key = _private_key_obj()
+    token = jwt.api_jws.encode(
+        orjson.dumps(full_payload), key, algorithm=_alg_for_key(key),
+        headers={"kid": _signing_kid(key), "iss": full_payload["iss"]},
+    )
     
     # Asegurar string (PyJWT devuelve bytes o str según versión)
     if isinstance(token, bytes):
         token = token.decode('utf-8')
 
-    return {"jti": jti, "token": token, "claims": full_payload}
+    return {"jti": full_payload["jti"], "token": token, "claims": full_payload}
+
+def issue_vc_jwt_batch(items: Iterable[Tuple[Dict[str, Any], str]], ttl: int = 3600) -> List[Dict[str, Any]]:
+    """
+    Emite varias VCs de una vez (p.ej. al cerrar una carrera con N corredores).
+    items: pares (candidate_vc, subject_did). El reloj, la clave y su algoritmo se
+    resuelven una sola vez para todo el lote: todas comparten iat/nbf/exp.
+    El JWS se compone a mano: la cabecera solo depende del emisor ('iss' replicado) y se
+    codifica una vez por emisor; por token solo se serializa el payload (orjson) y se firma.
+    """
+    now = int(time.time())
+    exp = now + int(ttl)
+    key = _private_key_obj()
+    alg = _alg_for_key(key)
+    signer = jwt.get_algorithm_by_name(alg)
+    kid = _signing_kid(key)
+    header_segments: Dict[str, bytes] = {}
+
+    issued = []
+    for candidate_vc, subject_did in items:
+        claims = _build_claims(candidate_vc, subject_did, now, exp)
+        iss = claims["iss"]
+        header_segment = header_segments.get(iss)
+        if header_segment is None:
+            header_segment = header_segments[iss] = _b64url(
+                orjson.dumps({"alg": alg, "typ": "JWT", "kid": kid, "iss": iss})
+            )
+        signing_input = header_segment + b"." + _b64url(orjson.dumps(claims))
+        token = signing_input + b"." + _b64url(signer.sign(signing_input, key))
+        issued.append({"jti": claims["jti"], "token": token.decode("ascii"), "claims": claims})
+    return issued
 
-def verify_jwt(token: str) -> Dict[str, Any]:
+def unverified_claims(token: str) -> Dict[str, Any]:
+    """
+    Lee el payload de un JWT SIN verificar la firma (solo visualización).
+    Es un base64url + JSON: evita jwt.decode y sus validaciones, que aquí no aportan nada.
+    """
+    _, payload_b64, _ = token.split(".", 2)
+    return orjson.loads(base64.urlsafe_b64decode(payload_b64 + "=" * (-len(payload_b64) % 4)))
+
+# Error genérico de verify_jwt para firmas y tokens mal formados (ver _verify_jwt_uncached)
+INVALID_TOKEN_ERROR: Final[str] = "invalid_token"
+
+# Opciones de jwt.decode, compartidas por todas las verificaciones (PyJWT las copia al
+# combinarlas con sus valores por defecto, no las muta). 'exp'/'iat' no se exigen: las
+# credenciales EBSI pueden no llevarlos, pero si vienen se validan.
+_VERIFY_OPTS: Final[Dict[str, Any]] = {"verify_aud": False, "require": ["iss", "sub"]}
+
+# Tope del tiempo que un resultado de verificación se reutiliza aunque el token dure más:
+# acota cuánto tarda en notarse una rotación de claves del emisor.
+VERIFY_CACHE_MAX_TTL = 300
+
+def verify_jwt(token: str, key: Any = None) -> Dict[str, Any]:
     """
     Verifica criptográficamente un token.
-    Utiliza el resolve_did_public_key para encontrar la clave correcta.
+    Los tokens son inmutables: un resultado OK se reutiliza (por hash del token) hasta
+    su 'exp', sin repetir la verificación de la firma (EdDSA/RS256). La revocación se
+    comprueba aparte, en BD.
+    `key` (opcional): clave pública ya conocida por el llamante, como objeto de
+    cryptography o PEM en bytes; en ese caso no se resuelve el DID ni se usa la caché.
+    """
+    if key is not None:
+        if isinstance(key, bytes):
+            key = _public_key_from_pem(key)
+        return _verify_jwt_uncached(token, key)
+
+    key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    cached = verify_cache.get(key)
+    if cached is not None:
+        result, exp = cached
+        if exp is None or exp > time.time():
+            return result
+
+    result = _verify_jwt_uncached(token)
+
+    # Solo cacheamos aciertos: un fallo es barato de repetir y no debe quedarse pegado
+    if result["ok"]:
+        exp = result["payload"].get("exp")
+        ttl = VERIFY_CACHE_MAX_TTL if exp is None else min(exp - time.time(), VERIFY_CACHE_MAX_TTL)
+        if ttl > 0:
+            verify_cache.set(key, (result, exp), ttl=ttl)
+    return result
+
+def _verify_jwt_uncached(token: str, key: Any = None) -> Dict[str, Any]:
+    """
+    Verificación completa de un token.
+    Sin `key`, utiliza el resolve_did_public_key para encontrar la clave correcta.
     """
     try:
-        # 1. Leer header sin verificar firma (para saber el ISSUER)
-        unverified = jwt.decode(token, options={"verify_signature": False})
-        issuer_did = unverified.get("iss", "")
+        if key is not None:
+            payload = jwt.decode(token, key, algorithms=[_alg_for_key(key)], options=_VERIFY_OPTS)
+            return {"ok": True, "payload": payload}
+
+        # 1. Leer el ISSUER sin verificar firma. Con 'iss' replicado en la cabecera basta
+        #    con decodificar el primer segmento (unas decenas de bytes); los tokens que no
+        #    lo llevan recurren al 'iss' del payload.
+        issuer_did = jwt.get_unverified_header(token).get("iss")
+        if not isinstance(issuer_did, str) or not issuer_did:
+            claims = unverified_claims(token)
+            issuer_did = claims.get("iss") if isinstance(claims, dict) else None
+            if not isinstance(issuer_did, str):
+                issuer_did = ""
         
         # 2. Resolver Clave Pública (Aquí ocurre la magia de la simulación)
-        pub_pem = resolve_did_public_key(issuer_did)
-        key = serialization.load_pem_public_key(pub_pem)
+        key = resolve_did_public_key(issuer_did)
         
         # 3. Verificar Firma matemática
-        payload = jwt.decode(token, key, algorithms=[ALG], options={"verify_aud": False})
+        #    Único decode verificado: el payload devuelto es el que usan las comprobaciones
+        #    posteriores (opciones en _VERIFY_OPTS).
+        payload = jwt.decode(token, key, algorithms=[_alg_for_key(key)], options=_VERIFY_OPTS)
+
+        # La clave se eligió por la cabecera: el 'iss' firmado debe ser ese mismo emisor
+        if payload["iss"] != issuer_did:
+            return {"ok": False, "error": "El 'iss' de la cabecera no corresponde al del payload."}
         
         return {"ok": True, "payload": payload}
         
     except jwt.ExpiredSignatureError:
         return {"ok": False, "error": "El token ha expirado (TTL vencido)."}
-    except Exception as e:
+    except jwt.MissingRequiredClaimError as e:
+        # Firma ya verificada: el motivo (claim ausente) no revela nada de la clave
         return {"ok": False, "error": str(e)}
+    except (jwt.PyJWTError, ValueError) as e:
+        # Firma, formato o base64 inválidos: una única respuesta para todos, sin distinguir
+        # por qué falló (no damos un oráculo al atacante). El motivo real va al log.
+        # ValueError cubre el base64/JSON del payload leído sin verificar.
+        logger.debug("Token rechazado: %r", e)
+        return {"ok": False, "error": INVALID_TOKEN_ERROR}
+
+# --- PRECARGA ---
+# Al importar: con un servidor que precarga la app (gunicorn --preload) los workers
+# heredan las claves ya parseadas. El lifespan vuelve a llamarla (coste cero si ya están).
+# Un fallo aquí no impide importar el módulo: se reintenta en el primer uso.
+try:
+    warm_up_keys()
+except Exception as e:
+    print(f"⚠️ Precarga de claves fallida (se reintentará al usarlas): {e}")
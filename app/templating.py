@@ -0,0 +1,191 @@
+from __future__ import annotations
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import (
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    ModuleLoader,
+    nodes,
+    select_autoescape,
+)
+from jinja2.ext import Extension
+
+from app.services.cache import TTLCache
+from app.services.vc import unverified_claims
+
+# --- ENTORNO JINJA COMPARTIDO ---
+# Un único Environment para toda la app: cada router reutiliza la misma caché de
+# plantillas compiladas en lugar de mantener la suya propia.
+TEMPLATES_DIR = pathlib.Path(__file__).resolve().parent / "templates"
+
+# En desarrollo (TEMPLATES_AUTO_RELOAD=1) se vuelve a comprobar el disco en cada render.
+AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "0").lower() in ("1", "true", "yes")
+
+# Plantillas precompiladas a módulos Python (ver Dockerfile). Se ignoran con auto-reload.
+PRECOMPILED_DIR = os.getenv("JINJA_PRECOMPILED_DIR") if not AUTO_RELOAD else None
+
+# Caché de bytecode en disco: los workers que arrancan después no vuelven a parsear.
+# Sin directorio explícito Jinja usa una carpeta privada dentro del tmp del sistema.
+_cache_dir = os.getenv("JINJA_CACHE_DIR")
+if _cache_dir:
+    pathlib.Path(_cache_dir).mkdir(parents=True, exist_ok=True)
+
+_fs_loader = FileSystemLoader(str(TEMPLATES_DIR))
+
+
+# --- CACHÉ DE FRAGMENTOS ---
+class FragmentCacheExtension(Extension):
+    """
+    Etiqueta {% cache timeout, clave1, clave2, ... %} ... {% endcache %}.
+    Memoriza el HTML renderizado del bloque; las claves deben cambiar cuando cambian
+    los datos (p.ej. una huella de las filas), así no dependemos solo del TTL.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment: Environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=TTLCache(maxsize=256))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        timeout = parser.parse_expression()
+        keys = []
+        while parser.stream.skip_if("comma"):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_cache_support", [timeout, nodes.Tuple(keys, "load")])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, timeout, keys, caller):
+        rv = self.environment.fragment_cache.get(keys)
+        if rv is None:
+            rv = caller()
+            self.environment.fragment_cache.set(keys, rv, ttl=timeout)
+        return rv
+
+
+env = Environment(
+    loader=_fs_loader,
+    autoescape=select_autoescape(),
+    auto_reload=AUTO_RELOAD,
+    cache_size=400,
+    extensions=[FragmentCacheExtension],
+    bytecode_cache=FileSystemBytecodeCache(_cache_dir) if _cache_dir else FileSystemBytecodeCache(),
+)
+
+templates = Jinja2Templates(env=env)
+
+
+# --- FILTROS ---
+# El formateo se hace al pintar: los endpoints pasan las filas tal cual, sin
+# construir una lista de dicts intermedia solo para renombrar campos.
+def fmt_dt(dt, fmt: str = "%Y-%m-%d %H:%M:%S", default: str = "-") -> str:
+    return dt.strftime(fmt) if dt else default
+
+
+def jwt_subject(token: str | None) -> dict:
+    """
+    Extrae evento/dorsal/nombre/tiempo del credentialSubject de un VC-JWT.
+    Solo visualización: lee el payload sin verificar la firma.
+    """
+    try:
+        vc_subject = unverified_claims(token).get("vc", {}).get("credentialSubject", {})
+    except Exception:
+        return {"event": "Desconocido", "bib": "-", "name": "-", "time": "-"}
+
+    # Corrección de anidamiento (si existe)
+    if "credentialSubject" in vc_subject:
+        vc_subject = vc_subject["credentialSubject"]
+
+    result = vc_subject.get("result")
+    return {
+        "event": vc_subject.get("event", "Evento Genérico"),
+        "bib": vc_subject.get("bib", "-"),
+        "name": vc_subject.get("name", "Atleta"),
+        "time": result.get("time", "-") if isinstance(result, dict) else vc_subject.get("time", "-"),
+    }
+
+
+env.filters["fmt_dt"] = fmt_dt
+env.filters["jwt_subject"] = jwt_subject
+
+
+# --- PÁGINAS ESTÁTICAS ---
+# Páginas sin contexto por usuario (landing, issuer, verifier): el HTML es siempre el mismo,
+# así que se renderiza una vez y se sirve con caché de navegador/proxy.
+STATIC_PAGE_HEADERS = {"Cache-Control": "public, max-age=300"}
+STATIC_PAGES = ("index.html", "issuer.html", "verifier.html")
+
+
+@lru_cache(maxsize=16)
+def _render_static_cached(name: str) -> str:
+    return env.get_template(name).render()
+
+
+def render_static(name: str) -> str:
+    """HTML de una plantilla sin contexto. Con auto-reload (desarrollo) no se memoriza."""
+    if AUTO_RELOAD:
+        return env.get_template(name).render()
+    return _render_static_cached(name)
+
+
+def compile_all(target: str | os.PathLike) -> None:
+    """
+    Compila todas las plantillas a módulos Python en `target`.
+    Se escribe en una carpeta temporal y se renombra al final, para que otro
+    worker nunca importe un módulo a medio escribir.
+    """
+    target = pathlib.Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".jinja_", dir=target.parent)
+    try:
+        env.compile_templates(tmp_dir, zip=None, ignore_errors=False)
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    except OSError:
+        # Otro worker ganó la carrera: su resultado es idéntico al nuestro
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not target.exists():
+            raise
+
+
+def use_precompiled() -> None:
+    """
+    Si JINJA_PRECOMPILED_DIR está configurado, carga las plantillas desde los módulos
+    precompilados (sin parseo ni compilación). Las que falten se leen del disco.
+    """
+    if not PRECOMPILED_DIR:
+        return
+    if not pathlib.Path(PRECOMPILED_DIR).is_dir():
+        compile_all(PRECOMPILED_DIR)
+    # La caché de plantillas está indexada por loader: cambiarlo invalida lo anterior
+    env.loader = ChoiceLoader([ModuleLoader(PRECOMPILED_DIR), _fs_loader])
+
+
+def warm_up() -> None:
+    """
+    Carga todas las plantillas una vez (arranque) para que la primera petición no pague
+    el parseo, y deja ya renderizado el HTML de las páginas estáticas.
+    """
+    use_precompiled()
+    for name in _fs_loader.list_templates():
+        if name.endswith(".html"):
+            env.get_template(name)
+    if not AUTO_RELOAD:
+        for name in STATIC_PAGES:
+            render_static(name)
+
+
+if __name__ == "__main__":
+    # Uso en build: python -m app.templating [carpeta_destino]
+    compile_all(sys.argv[1] if len(sys.argv) > 1 else PRECOMPILED_DIR or "jinja_compiled")
@@ -1,21 +1,23 @@
+import argparse
 import os
 from pathlib import Path
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
 
 # --- PARÁMETROS CRIPTOGRÁFICOS (Estándares NIST/W3C) ---
-# Tamaño de clave: 2048 bits es el estándar mínimo actual para RSA.
-# Provee un equilibrio adecuado entre seguridad y rendimiento para firmas JWT.
-KEY_SIZE = 2048
+# Ed25519 (EdDSA, RFC 8037): firma en decenas de microsegundos frente al milisegundo
+# largo de RSA 2048, y firmas de 64 bytes en lugar de 256 (tokens más cortos).
+# La app deduce el algoritmo JWT del tipo de clave, así que las claves RSA ya
+# desplegadas siguen funcionando (RS256).
 
-# Exponente público: 65537 (Fermat F4).
-# Es el estándar industrial porque permite una verificación de firma muy rápida
-# y es seguro contra ataques a exponentes pequeños.
-PUBLIC_EXPONENT = 65537
+# Solo con --rsa (verificadores que aún no admiten EdDSA): RSA 2048, exponente 65537 (F4)
+RSA_KEY_SIZE = 2048
+RSA_PUBLIC_EXPONENT = 65537
 
-def generate_keys():
+def generate_keys(use_rsa: bool = False):
     """
-    Genera un par de claves RSA (Pública/Privada) para la firma de credenciales.
+    Genera un par de claves (Pública/Privada) para la firma de credenciales:
+    Ed25519 por defecto, o RSA si use_rsa=True (firmas RS256).
     Este script actúa como el proceso de 'Bootstrapping' de la identidad del Emisor.
     """
     
@@ -35,13 +37,13 @@ def generate_keys():
         print("   Sobrescribirlas invalidará todas las credenciales emitidas anteriormente.")
         # En un entorno real pediríamos confirmación, para el MVP sobrescribimos/regeneramos.
 
-    print(f"🔄 Generando nuevo par de claves RSA ({KEY_SIZE} bits)...")
-
     # 2. Generación de la Clave Privada
-    private_key = rsa.generate_private_key(
-        public_exponent=PUBLIC_EXPONENT,
-        key_size=KEY_SIZE,
-    )
+    if use_rsa:
+        print(f"🔄 Generando nuevo par de claves RSA ({RSA_KEY_SIZE} bits, RS256)...")
+        private_key = rsa.generate_private_key(public_exponent=RSA_PUBLIC_EXPONENT, key_size=RSA_KEY_SIZE)
+    else:
+        print("🔄 Generando nuevo par de claves Ed25519 (EdDSA)...")
+        private_key = ed25519.Ed25519PrivateKey.generate()
 
     # 3. Serialización (Guardado en disco)
     
@@ -73,4 +75,6 @@ def generate_keys():
     print(f"   🌍 Pública: {public_key_path} (Para el Verificador)")
 
 if __name__ == "__main__":
-    generate_keys()
+    parser = argparse.ArgumentParser(description="Genera el par de claves del Emisor (app/keys).")
+    parser.add_argument("--rsa", action="store_true", help="Clave RSA 2048 (RS256) en lugar de Ed25519")
+    generate_keys(use_rsa=parser.parse_args().rsa)
@@ -0,0 +1,37 @@
+import sys
+import os
+import shutil
+import tempfile
+
+# --- CONFIGURACIÓN DEL ENTORNO DE TEST ---
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# BD aislada en un fichero temporal: se fija antes de que ningún test importe la app
+# (el engine se crea al importar app.db.session con DATABASE_URL)
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="dap-test-")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(_TEST_DB_DIR, "test.db"))
+
+import pytest
+
+from app.db.session import Base, engine
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_TEST_DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db_engine(anyio_backend):
+    """
+    Tablas creadas en la BD de pruebas. Al terminar se cierran las conexiones del pool:
+    cada test async corre en su propio event loop.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
@@ -0,0 +1,191 @@
+import sys
+import os
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# --- CONFIGURACIÓN DEL ENTORNO DE TEST ---
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+from app.main import app
+from app.api import admin, holder, issuer, verifier
+from app.templating import env, render_static
+from app.db.models import Credential, Nonce
+from app.db.session import Base, SessionLocal, engine
+
+# ==========================================
+# SUITE DE PRUEBAS: REGISTRO DE RUTAS
+# ==========================================
+
+def test_each_route_is_registered_once():
+    """
+    [Integration Test] Cada router se incluye una sola vez en la app.
+    Una ruta duplicada quedaría sombreada y alargaría el recorrido del router en cada petición.
+    """
+    registered = Counter(
+        (route.path, method)
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    )
+    duplicated = [key for key, count in registered.items() if count > 1]
+    assert duplicated == []
+
+    expected = [
+        ("/admin/db", "GET"),
+        ("/admin/ui", "GET"),
+        ("/admin/revoke", "POST"),
+        ("/holder", "GET"),
+        ("/holder/{jti}.json", "GET"),
+        ("/holder/{jti}/qr.png", "GET"),
+    ]
+    for key in expected:
+        assert registered[key] == 1, key
+
+
+def test_routers_share_one_jinja_environment():
+    """
+    [Unit Test] Todas las vistas renderizan con el mismo Environment de Jinja
+    (una sola caché de plantillas compiladas) y sin auto-reload por defecto.
+    """
+    for module in (admin, holder):
+        assert module.templates.env is env, module.__name__
+
+    # Las páginas estáticas (landing, issuer, verifier) se renderizan una sola vez
+    for module in (issuer, verifier):
+        assert module.render_static is render_static, module.__name__
+    assert render_static("index.html") is render_static("index.html")
+
+    assert env.auto_reload is False
+    assert env.bytecode_cache is not None
+
+
+def test_orm_models_are_mapped_once():
+    """
+    [Unit Test] Un único módulo de modelos: cada tabla y cada clase mapeada existen una sola vez.
+    """
+    assert sorted(Base.metadata.tables) == ["credentials", "nonces"]
+
+    mapped = Counter(mapper.class_.__name__ for mapper in Base.registry.mappers)
+    assert mapped == {"Credential": 1, "Nonce": 1}
+
+
+# ==========================================
+# SUITE DE PRUEBAS: VERIFICADOR (HTTP)
+# ==========================================
+
+VC_BODY = {"type": "VC", "credentialSubject": {"event": "HYROX", "bib": "1", "name": "A"}}
+
+
+def _issue(client):
+    issued = client.post("/issuer/issue?subject_did=did:web:athlete:test", json=VC_BODY).json()
+    return issued["jti"], issued["token"]
+
+
+async def _revoke_in_db(jti: str) -> None:
+    """Revocación directa en BD, como la haría otro worker: sin tocar las cachés de este proceso."""
+    async with SessionLocal() as session:
+        await session.execute(update(Credential).where(Credential.jti == jti).values(status="revoked"))
+        await session.commit()
+
+
+def test_revocation_by_another_process_is_seen_immediately():
+    """
+    [Security Test] Tras revocar en BD, /verify y /scan rechazan la credencial en la
+    siguiente petición aunque su token siga en la caché de este proceso.
+    """
+    with TestClient(app) as client:
+        jti, token = _issue(client)
+        assert client.post("/verifier/verify", json={"token": token}).json()["result"] == "valid"
+        assert client.get(f"/verifier/scan?jti={jti}").json()["result"] == "valid"
+
+        client.portal.call(_revoke_in_db, jti)
+
+        assert client.post("/verifier/verify", json={"token": token}).json()["flag"] == "revoked"
+        assert client.get(f"/verifier/scan?jti={jti}").json()["flag"] == "revoked"
+
+
+async def _expire_nonce(value: str) -> None:
+    async with SessionLocal() as session:
+        await session.execute(
+            update(Nonce).where(Nonce.value == value)
+            .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        await session.commit()
+
+
+def test_nonce_is_consumed_once():
+    """
+    [Anti-Replay Test] Un reto válido se consume en la primera verificación; repetirlo
+    se diagnostica como reutilización (nonce_used).
+    """
+    with TestClient(app) as client:
+        _, token = _issue(client)
+        nonce = client.get("/verifier/challenge").json()["nonce"]
+
+        assert client.post("/verifier/verify", json={"token": token, "nonce": nonce}).json()["result"] == "valid"
+        replay = client.post("/verifier/verify", json={"token": token, "nonce": nonce}).json()
+
+    assert replay["result"] == "invalid"
+    assert replay["flag"] == "nonce_used"
+
+
+def test_expired_nonce_is_rejected():
+    """
+    [Anti-Replay Test] Un reto caducado (y sin consumir) se rechaza como nonce_expired,
+    y el rechazo no lo consume.
+    """
+    with TestClient(app) as client:
+        _, token = _issue(client)
+        nonce = client.get("/verifier/challenge").json()["nonce"]
+        client.portal.call(_expire_nonce, nonce)
+
+        first = client.post("/verifier/verify", json={"token": token, "nonce": nonce}).json()
+        second = client.post("/verifier/verify", json={"token": token, "nonce": nonce}).json()
+
+    assert first["flag"] == second["flag"] == "nonce_expired"
+
+
+def test_unknown_nonce_is_rejected():
+    """
+    [Anti-Replay Test] Un nonce que el verificador nunca emitió se rechaza como nonce_invalid.
+    """
+    with TestClient(app) as client:
+        _, token = _issue(client)
+        result = client.post("/verifier/verify", json={"token": token, "nonce": "inventado"}).json()
+
+    assert result["result"] == "invalid"
+    assert result["flag"] == "nonce_invalid"
+
+
+# ==========================================
+# SUITE DE PRUEBAS: EMISOR SIN LIFESPAN
+# ==========================================
+
+async def _create_tables() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+def test_issuer_works_without_lifespan_pools():
+    """
+    [Integration Test] Sin lifespan (TestClient sin 'with') no existen los pools de
+    app.state: la firma y el OCR caen al executor por defecto en lugar de dar un 500.
+    """
+    asyncio.run(_create_tables())
+    client = TestClient(app)
+    try:
+        issued = client.post("/issuer/issue?subject_did=did:web:athlete:test", json=VC_BODY)
+        assert issued.status_code == 200
+        assert issued.json()["status"] == "ok"
+
+        image = os.path.join(os.path.dirname(__file__), "sample_race.png")
+        with open(image, "rb") as f:
+            ocr = client.post("/issuer/ocr", files={"file": ("race.png", f, "image/png")})
+        assert ocr.status_code == 200
+    finally:
+        asyncio.run(engine.dispose())
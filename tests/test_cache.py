@@ -0,0 +1,57 @@
+import sys
+import os
+import time
+
+# --- CONFIGURACIÓN DEL ENTORNO DE TEST ---
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.cache import TTLCache
+
+# ==========================================
+# SUITE DE PRUEBAS: CACHÉ EN MEMORIA (LRU + TTL)
+# ==========================================
+
+def test_lru_eviction_keeps_recent_entries():
+    """
+    [Unit Test] Al superar maxsize se expulsa la entrada menos usada recientemente.
+    """
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Tocamos 'a' para que 'b' pase a ser la más antigua
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl():
+    """
+    [Time Test] Las entradas caducan según el TTL por defecto o el indicado en set().
+    """
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("largo", "ok")
+    cache.set("corto", "ok", ttl=0.01)
+
+    time.sleep(0.02)
+
+    assert cache.get("corto") is None
+    assert cache.get("largo") == "ok"
+
+
+def test_pop_and_clear_invalidate():
+    """
+    [Unit Test] Invalidación explícita (usada al revocar credenciales).
+    """
+    cache = TTLCache()
+    cache.set("jti-1", b"png")
+    cache.set("jti-2", b"png")
+
+    assert cache.pop("jti-1") == b"png"
+    assert cache.pop("jti-1") is None
+
+    cache.clear()
+    assert len(cache) == 0
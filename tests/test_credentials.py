@@ -0,0 +1,52 @@
+import uuid
+
+import pytest
+from sqlalchemy import update
+
+from app.db.models import Credential
+from app.db.session import SessionLocal
+from app.services.credentials import get_credential
+
+# ==========================================
+# SUITE DE PRUEBAS: LECTURA DE CREDENCIALES POR JTI
+# ==========================================
+
+pytestmark = pytest.mark.anyio
+
+
+async def _new_credential() -> str:
+    jti = f"urn:uuid:{uuid.uuid4()}"
+    async with SessionLocal() as session:
+        session.add(Credential(jti=jti, token="header.payload.firma", status="valid"))
+        await session.commit()
+    return jti
+
+
+async def _revoke(jti: str) -> None:
+    async with SessionLocal() as session:
+        await session.execute(update(Credential).where(Credential.jti == jti).values(status="revoked"))
+        await session.commit()
+
+
+async def test_revocation_is_seen_on_next_read(db_engine):
+    """
+    [Security Test] Una revocación hecha por otro proceso o sesión se ve en la siguiente
+    lectura: el estado nunca sale de una caché en memoria.
+    """
+    jti = await _new_credential()
+    async with SessionLocal() as db:
+        assert (await get_credential(db, jti)).status == "valid"
+
+        await _revoke(jti)
+        credential = await get_credential(db, jti)
+
+    assert credential.status == "revoked"
+    assert credential.token == "header.payload.firma"
+
+
+async def test_unknown_jti_returns_none(db_engine):
+    """
+    [Unit Test] Un JTI inexistente devuelve None.
+    """
+    async with SessionLocal() as db:
+        assert await get_credential(db, "urn:uuid:no-existe") is None
@@ -1,7 +1,18 @@
+import os
 import pytest
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
 # Importamos las funciones del servicio
-from app.services.vc import issue_vc_jwt, verify_jwt
+from app.services.vc import (
+    issue_vc_jwt, issue_vc_jwt_batch, verify_jwt, unverified_claims, resolve_did_public_key,
+    clear_key_caches, get_jwks_bytes, INVALID_TOKEN_ERROR,
+    _alg_for_key, _get_public_key, _private_key_obj, _public_key_from_pem, _signing_alg,
+    _key_files, _preload_key_dir, _read_key_file_cached, _public_jwk,
+)
+from app.services.cache import did_key_cache, verify_cache
 
 # --- DATOS DE PRUEBA ---
 MOCK_DID_ISSUER = "did:web:dap-project.org"
@@ -101,3 +112,233 @@ def test_verify_expired_token_fails():
     error_msg = str(verification.get("error")).lower()
     assert "expirado" in error_msg or "expired" in error_msg
 
+
+def test_unverified_claims_matches_signed_payload():
+    """
+    [Unit Test] Lectura rápida del payload (sin verificar firma) para visualización.
+    Debe devolver exactamente los claims firmados, incluidos caracteres no ASCII.
+    """
+    issued = issue_vc_jwt({"event": "Maratón de Málaga"}, MOCK_DID_HOLDER, ttl=60)
+
+    claims = unverified_claims(issued["token"])
+
+    assert claims == issued["claims"]
+
+
+def test_verify_result_is_cached_until_exp():
+    """
+    [Cache Test] Una verificación correcta se reutiliza para el mismo token,
+    pero nunca más allá de su 'exp'.
+    """
+    verify_cache.clear()
+    issued = issue_vc_jwt(MOCK_VC_DATA, MOCK_DID_HOLDER, ttl=2)
+
+    first = verify_jwt(issued["token"])
+    assert first["ok"] is True
+    assert verify_jwt(issued["token"]) is first
+
+    # Pasado el exp, se vuelve a verificar (y falla por expiración)
+    time.sleep(2.1)
+    expired = verify_jwt(issued["token"])
+    assert expired["ok"] is False
+
+
+def test_did_resolution_is_cached_per_did():
+    """
+    [Cache Test] La clave de un DID se resuelve una vez y se reutiliza hasta su TTL.
+    """
+    clear_key_caches()
+
+    key = resolve_did_public_key(MOCK_DID_ISSUER)
+    assert did_key_cache.get(MOCK_DID_ISSUER) is key
+    assert resolve_did_public_key(MOCK_DID_ISSUER) is key
+
+
+def test_key_objects_are_parsed_once():
+    """
+    [Cache Test] Las claves se deserializan una vez: firma y verificación reutilizan
+    el mismo objeto (la caché pública va por PEM, así una rotación no reutiliza la vieja).
+    """
+    assert _private_key_obj() is _private_key_obj()
+
+    pem = _get_public_key()
+    assert _public_key_from_pem(pem) is _public_key_from_pem(pem)
+    assert resolve_did_public_key(MOCK_DID_ISSUER) is _public_key_from_pem(pem)
+
+
+def test_token_without_subject_is_rejected():
+    """
+    [Security Test] 'iss' y 'sub' son obligatorios en el decode verificado.
+    """
+    token = jwt.encode({"iss": MOCK_DID_ISSUER, "vc": {}}, _private_key_obj(), algorithm=_signing_alg())
+    result = verify_jwt(token)
+
+    assert result["ok"] is False
+    assert "sub" in result["error"]
+
+
+@pytest.mark.parametrize("private_key, alg", [
+    (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+    (rsa.generate_private_key(public_exponent=65537, key_size=2048), "RS256"),
+])
+def test_algorithm_follows_key_type(private_key, alg):
+    """
+    [Compat Test] EdDSA para claves Ed25519 y RS256 para las RSA ya desplegadas,
+    tanto al firmar (clave privada) como al verificar (clave pública).
+    """
+    public_key = private_key.public_key()
+    assert _alg_for_key(private_key) == _alg_for_key(public_key) == alg
+
+    token = jwt.encode({"iss": MOCK_DID_ISSUER, "sub": MOCK_DID_HOLDER}, private_key, algorithm=alg)
+    assert jwt.decode(token, public_key, algorithms=[_alg_for_key(public_key)])["sub"] == MOCK_DID_HOLDER
+
+
+def test_batch_issuance_shares_clock_and_key():
+    """
+    [Batch Test] Un lote firma cada VC con su propio jti y subject, y un mismo iat/exp.
+    """
+    holders = [f"did:web:athlete:{i}" for i in range(3)]
+    issued = issue_vc_jwt_batch([(MOCK_VC_DATA, did) for did in holders], ttl=60)
+
+    assert len({item["jti"] for item in issued}) == 3
+    assert len({(item["claims"]["iat"], item["claims"]["exp"]) for item in issued}) == 1
+    for item, did in zip(issued, holders):
+        result = verify_jwt(item["token"])
+        assert result["ok"] is True
+        assert result["payload"]["sub"] == did
+
+
+def test_key_file_is_reread_only_when_it_changes(tmp_path):
+    """
+    [Cache Test] El fichero de clave se memoriza por mtime: sin cambios no se relee,
+    y una rotación en disco se detecta sin reiniciar.
+    """
+    key_file = tmp_path / "private.pem"
+    key_file.write_bytes(b"clave-1")
+    assert _read_key_file_cached(str(key_file)) == b"clave-1"
+
+    # Mismo mtime: se sirve lo memorizado aunque el contenido haya cambiado
+    stat = key_file.stat()
+    key_file.write_bytes(b"clave-2")
+    os.utime(key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert _read_key_file_cached(str(key_file)) == b"clave-1"
+
+    # Rotación: mtime nuevo => relectura
+    os.utime(key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert _read_key_file_cached(str(key_file)) == b"clave-2"
+
+    os.remove(key_file)
+    with pytest.raises(FileNotFoundError):
+        _read_key_file_cached(str(key_file))
+
+
+def test_issuer_is_read_from_header():
+    """
+    [Security Test] El emisor se lee del 'iss' replicado en la cabecera; si no coincide
+    con el 'iss' firmado del payload, el token se rechaza.
+    """
+    issued = issue_vc_jwt(MOCK_VC_DATA, MOCK_DID_HOLDER)
+    assert jwt.get_unverified_header(issued["token"])["iss"] == issued["claims"]["iss"]
+    assert verify_jwt(issued["token"])["ok"] is True
+
+    forged = jwt.encode(
+        {"iss": MOCK_DID_ISSUER, "sub": MOCK_DID_HOLDER}, _private_key_obj(),
+        algorithm=_signing_alg(), headers={"iss": "did:web:otro-emisor"},
+    )
+    result = verify_jwt(forged)
+    assert result["ok"] is False
+    assert "iss" in result["error"]
+
+
+def test_private_key_object_is_shared_across_threads():
+    """
+    [Cache Test] Todas las firmas (también desde el pool de hilos) usan el mismo objeto
+    de clave privada: no se vuelve a parsear el PEM por emisión.
+    """
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        keys = list(pool.map(lambda _: _private_key_obj(), range(8)))
+    assert all(key is keys[0] for key in keys)
+
+
+
+def test_key_dir_is_preloaded_in_one_scan(tmp_path):
+    """
+    [Cache Test] La precarga deja en memoria todos los .pem de la carpeta: la lectura
+    posterior no vuelve a abrir el fichero mientras no cambie su mtime.
+    """
+    (tmp_path / "private.pem").write_bytes(b"priv")
+    (tmp_path / "public.pem").write_bytes(b"pub")
+    (tmp_path / "README.txt").write_bytes(b"no es una clave")
+
+    _preload_key_dir(tmp_path)
+
+    # Mismo mtime y otro contenido: lo que se lee tiene que venir de la precarga
+    for name in ("private.pem", "public.pem"):
+        key_file = tmp_path / name
+        stat = key_file.stat()
+        key_file.write_bytes(b"otro")
+        os.utime(key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert _read_key_file_cached(tmp_path / "private.pem") == b"priv"
+    assert _read_key_file_cached(tmp_path / "public.pem") == b"pub"
+    assert tmp_path / "README.txt" not in _key_files
+
+
+def test_verify_with_explicit_key_skips_resolution():
+    """
+    [Unit Test] Con la clave ya conocida (objeto o PEM) se verifica sin resolver el DID;
+    una clave que no corresponde a la firma se rechaza.
+    """
+    token = issue_vc_jwt(MOCK_VC_DATA, MOCK_DID_HOLDER)["token"]
+    public_key = _private_key_obj().public_key()
+
+    did_key_cache.clear()
+    assert verify_jwt(token, key=public_key)["ok"] is True
+    assert verify_jwt(token, key=_get_public_key())["ok"] is True
+    assert len(did_key_cache) == 0
+
+    other_key = ed25519.Ed25519PrivateKey.generate().public_key()
+    assert verify_jwt(token, key=other_key)["ok"] is False
+
+
+@pytest.mark.parametrize("token", [
+    "no-es-un-jwt",
+    "a.b.c",
+    "eyJhbGciOiJFZERTQSJ9.e30.AAAA",
+])
+def test_malformed_tokens_share_one_error(token):
+    """
+    [Security Test] Firma inválida y token mal formado devuelven el mismo error genérico,
+    sin detalles de dónde falló la decodificación.
+    """
+    issued = issue_vc_jwt(MOCK_VC_DATA, MOCK_DID_HOLDER)
+    header, payload, _ = issued["token"].split(".")
+    bad_signature = verify_jwt(f"{header}.{payload}.AAAA")
+
+    assert bad_signature == verify_jwt(token) == {"ok": False, "error": INVALID_TOKEN_ERROR}
+
+
+def test_jwks_matches_token_kid_and_verifies():
+    """
+    [Interop Test] El JWKS pre-serializado publica la clave con 'kid' = huella RFC 7638,
+    el mismo 'kid' que llevan los tokens de cualquier emisor (por defecto o propio),
+    y esa clave verifica su firma.
+    """
+    assert get_jwks_bytes() is get_jwks_bytes()
+    jwks = jwt.PyJWKSet.from_json(get_jwks_bytes().decode())
+
+    tokens = [
+        issue_vc_jwt({"dorsal": "1"}, MOCK_DID_HOLDER)["token"],
+        issue_vc_jwt({"dorsal": "2", "issuer": "did:web:jalbfil.github.io"}, MOCK_DID_HOLDER)["token"],
+        *(item["token"] for item in issue_vc_jwt_batch([({"dorsal": "3", "issuer": MOCK_DID_ISSUER}, MOCK_DID_HOLDER)])),
+    ]
+    for token in tokens:
+        jwk = jwks[jwt.get_unverified_header(token)["kid"]]
+        assert jwt.decode(token, jwk.key, algorithms=[jwk.algorithm_name])["sub"] == MOCK_DID_HOLDER
+
+    # RFC 7638, ejemplo 3.1: huella conocida de una clave RSA
+    rfc_key = jwt.PyJWK({
+        "kty": "RSA", "e": "AQAB",
+        "n": "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw",
+    }).key
+    assert _public_jwk(rfc_key)["kid"] == "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs"
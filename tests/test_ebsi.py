@@ -7,7 +7,7 @@ import jwt # PyJWT
 # Insertamos la raíz del proyecto en el path para importar los módulos de la app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.services.vc import verify_jwt, _get_private_key
+from app.services.vc import verify_jwt, _get_private_key, _signing_alg
 
 # ==========================================
 # SUITE DE PRUEBAS: INTEROPERABILIDAD EUROPEA (EBSI)
@@ -64,7 +64,7 @@ def test_ebsi_compatibility_flow():
     # En la realidad, el Resolver bajaría esta clave pública de la Blockchain.
     # En la simulación (vc.py), el Resolver devuelve nuestra clave local.
     local_private_key = _get_private_key()
-    token_ebsi = jwt.encode(token_payload, local_private_key, algorithm="RS256")
+    token_ebsi = jwt.encode(token_payload, local_private_key, algorithm=_signing_alg())
 
     # 3. VERIFICACIÓN (PRUEBA DE ARQUITECTURA)
     # Llamamos al verificador real del sistema.
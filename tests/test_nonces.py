@@ -0,0 +1,153 @@
+import asyncio
+import secrets
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.db.models import Nonce
+from app.db.session import SessionLocal
+from app.services import nonces
+from app.services.nonces import NONCE_RETENTION, NonceWriter, run_sweeper, sweep_expired_nonces
+
+# ==========================================
+# SUITE DE PRUEBAS: NONCES (ESCRITURA AGRUPADA Y LIMPIEZA)
+# ==========================================
+
+pytestmark = pytest.mark.anyio
+
+
+def _expires(seconds: int = 60) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+
+async def _stored(values) -> set[str]:
+    async with SessionLocal() as session:
+        rows = await session.execute(select(Nonce.value).where(Nonce.value.in_(list(values))))
+        return set(rows.scalars())
+
+
+def _spy_batches(writer: NonceWriter, monkeypatch) -> list[int]:
+    """Tamaño de cada lote que el writer confirma (una transacción por lote)."""
+    sizes = []
+    write_batch = writer._write_batch
+
+    async def spy(batch):
+        sizes.append(len(batch))
+        await write_batch(batch)
+
+    monkeypatch.setattr(writer, "_write_batch", spy)
+    return sizes
+
+
+async def test_concurrent_adds_share_one_commit(db_engine, monkeypatch):
+    """
+    [Batch Test] Varios add() concurrentes se confirman en una sola transacción.
+    """
+    writer = NonceWriter()
+    sizes = _spy_batches(writer, monkeypatch)
+    values = [secrets.token_urlsafe(8) for _ in range(5)]
+
+    writer.start()
+    try:
+        await asyncio.gather(*(writer.add(value, _expires()) for value in values))
+    finally:
+        await writer.stop()
+
+    assert sizes == [5]
+    assert await _stored(values) == set(values)
+
+
+async def test_failed_batch_fails_every_waiter(db_engine):
+    """
+    [Failure Test] Si la transacción del lote falla (aquí, un nonce duplicado), todos los
+    add() de ese lote reciben el error en lugar de quedarse esperando, y el writer sigue vivo.
+    """
+    writer = NonceWriter()
+    duplicated, other = secrets.token_urlsafe(8), secrets.token_urlsafe(8)
+
+    writer.start()
+    try:
+        results = await asyncio.wait_for(asyncio.gather(
+            writer.add(duplicated, _expires()),
+            writer.add(duplicated, _expires()),
+            writer.add(other, _expires()),
+            return_exceptions=True,
+        ), timeout=5)
+        assert all(isinstance(result, IntegrityError) for result in results)
+        assert await _stored([duplicated, other]) == set()
+
+        # El siguiente lote se escribe con normalidad
+        await asyncio.wait_for(writer.add(other, _expires()), timeout=5)
+        assert await _stored([other]) == {other}
+    finally:
+        await writer.stop()
+
+
+async def test_stop_drains_pending_adds(db_engine, monkeypatch):
+    """
+    [Shutdown Test] stop() confirma todo lo que ya estaba en cola (en varios lotes) antes
+    de parar; después, add() falla en lugar de quedarse colgado.
+    """
+    writer = NonceWriter(max_batch=2)
+    sizes = _spy_batches(writer, monkeypatch)
+    values = [secrets.token_urlsafe(8) for _ in range(5)]
+
+    writer.start()
+    pending = [asyncio.create_task(writer.add(value, _expires())) for value in values]
+    await asyncio.sleep(0)  # los add() encolan antes de la parada
+    await writer.stop()
+
+    await asyncio.wait_for(asyncio.gather(*pending), timeout=5)
+    assert sum(sizes) == 5 and max(sizes) <= 2
+    assert await _stored(values) == set(values)
+
+    assert writer.running is False
+    with pytest.raises(RuntimeError):
+        await writer.add(secrets.token_urlsafe(8), _expires())
+
+
+async def test_sweep_deletes_only_expired_in_batches(db_engine, monkeypatch):
+    """
+    [Cleanup Test] Con más caducados que SWEEP_BATCH, el barrido hace varios lotes y
+    borra todos; los vigentes y los caducados dentro de NONCE_RETENTION se conservan.
+    """
+    monkeypatch.setattr(nonces, "SWEEP_BATCH", 10)
+    now = datetime.now(timezone.utc)
+    old = {secrets.token_urlsafe(8): now - timedelta(seconds=NONCE_RETENTION + 60) for _ in range(25)}
+    recent = {secrets.token_urlsafe(8): now - timedelta(seconds=30) for _ in range(2)}
+    live = {secrets.token_urlsafe(8): now + timedelta(seconds=60) for _ in range(3)}
+
+    async with SessionLocal() as session:
+        session.add_all(
+            Nonce(value=value, expires_at=expires_at)
+            for value, expires_at in {**old, **recent, **live}.items()
+        )
+        await session.commit()
+
+    assert await sweep_expired_nonces(now) == 25
+    assert await _stored([*old, *recent, *live]) == {*recent, *live}
+
+
+async def test_sweeper_logs_failures_and_keeps_running(db_engine, monkeypatch, caplog):
+    """
+    [Failure Test] Un barrido fallido se registra en el log y el bucle sigue vivo.
+    """
+    calls = 0
+
+    async def failing_sweep():
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(nonces, "sweep_expired_nonces", failing_sweep)
+    sweeper = asyncio.create_task(run_sweeper(interval=0))
+    while calls < 2:
+        await asyncio.sleep(0)
+    sweeper.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await sweeper
+
+    assert "Limpieza de nonces fallida" in caplog.text
+    assert "database is locked" in caplog.text
@@ -1,3 +1,4 @@
+import io
 import sys
 import os
 import pytest
@@ -7,7 +8,11 @@ from pathlib import Path
 # Inyectamos el path de la aplicación para poder importar los servicios
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.services.ocr import extract_race_data
+from PIL import Image
+
+from app.services.ocr import (
+    OCR_MAX_DIM, extract_race_data, _otsu_threshold, _preprocess, _estimate_skew, _find_event, _parse_fields
+)
 
 # ==========================================
 # SUITE DE PRUEBAS: VISIÓN ARTIFICIAL (OCR)
@@ -68,3 +73,70 @@ def test_ocr_pipeline_integration():
     
     # Si tu imagen de prueba es buena, puedes descomentar esto para validar precisión:
     # assert result["time"] is not None, "No se detectó el tiempo en la imagen de muestra"
+
+
+def test_preprocess_binarizes_with_otsu():
+    """
+    [Unit Test] El preprocesado deja solo tinta (0) y fondo (255), con el umbral
+    entre los dos niveles dominantes, y reduce las imágenes muy grandes a OCR_MAX_DIM.
+    """
+    # Fondo claro (200) con un bloque de "tinta" oscura (40)
+    image = Image.new('L', (2400, 100), 200)
+    image.paste(40, (100, 20, 600, 80))
+
+    threshold = _otsu_threshold(image.histogram())
+    assert 40 <= threshold < 200
+
+    binary = _preprocess(image)
+    assert max(binary.size) == OCR_MAX_DIM
+    assert sorted(c for _, c in binary.getcolors()) == [0, 255]
+
+
+def test_preprocess_decodes_large_jpeg_in_draft_mode():
+    """
+    [Unit Test] Una foto JPEG grande se decodifica reducida y en gris (draft de libjpeg)
+    y termina con el lado largo en OCR_MAX_DIM.
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (OCR_MAX_DIM * 4, OCR_MAX_DIM * 3), (200, 200, 200)).save(buffer, 'JPEG')
+
+    image = Image.open(buffer)
+    image.draft('L', (OCR_MAX_DIM, OCR_MAX_DIM))
+    assert image.mode == 'L' and max(image.size) < OCR_MAX_DIM * 4
+
+    buffer.seek(0)
+    binary = _preprocess(Image.open(buffer))
+    assert max(binary.size) == OCR_MAX_DIM
+
+
+def test_estimate_skew_recovers_rotation():
+    """
+    [Unit Test] El deskew detecta la inclinación de unas "líneas de texto" sintéticas
+    y devuelve el ángulo que las endereza.
+    """
+    page = Image.new('L', (800, 500), 255)
+    for top in range(60, 460, 80):
+        page.paste(0, (80, top, 720, top + 30))
+
+    assert _estimate_skew(page) == 0
+    tilted = page.rotate(5, expand=True, fillcolor=255)
+    assert abs(_estimate_skew(tilted) + 5) <= 0.4
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Etiquetas explícitas (aunque el nombre se extienda a la línea siguiente)
+    ("HYROX Madrid 2025\nNombre: Ana Lopez\nTiempo: 1:05\nDorsal: 2024",
+     {"event": "HYROX Madrid 2025", "bib": "2024", "time": "1:05", "name": "Ana Lopez\nTiempo"}),
+    # Sin etiquetas: fallbacks, saltando el año como dorsal
+    ("Resultados 2025 hyrox\n 1:02:03  4521 ",
+     {"event": "Resultados 2025 hyrox", "bib": "4521", "time": "1:02:03", "name": None}),
+    # La etiqueta gana al formato suelto aunque aparezca después
+    ("00:59:59 812\nTIME. 1:10:00 bib 77",
+     {"event": None, "bib": "77", "time": "1:10:00", "name": None}),
+    ("", {"event": None, "bib": None, "time": None, "name": None}),
+])
+def test_fields_are_parsed_in_a_single_pass(text, expected):
+    """
+    [Unit Test] La alternancia única da los mismos campos que buscar cada patrón por separado.
+    """
+    assert {"event": _find_event(text), **_parse_fields(text)} == expected